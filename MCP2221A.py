@@ -5,17 +5,34 @@ import usb.control
 import time
 import ctypes
 import traceback
+import array
+import codecs
+import reportDecoder
+import metrics
+import capture
+import usbIndex
+
+try:
+    import usb1  # python-libusb1, optional: hotplug notification while waiting for reset
+except ImportError:
+    usb1 = None
 
 HID_INTERFACE = 0x02
 INPUT_ENDPOINT = 0x83
 OUTPUT_ENDPOINT = 0x3
 HID_PKT_SIZE = 64
+USB_VENDOR_ID = 0x4d8
+USB_PRODUCT_ID = 0xdd
 
-STATUS_COMMAND = '\x10' + ('\x00' * 63)
+RECONNECT_TIMEOUT = 5.0         # Seconds resetChip() waits for the chip to re-enumerate
+RECONNECT_POLL_MIN = 0.005      # First re-enumeration poll interval, doubled up to RECONNECT_POLL_MAX
+RECONNECT_POLL_MAX = 0.1
+RECONNECT_STATUS_TIMEOUT = 100  # ms, status command confirming the chip is ready
 
 CMD_WRITE = 0xB1
 CMD_READ = 0xB0
 
+WRITE_CHIP_SETTINGS = 0x00
 WRITE_GP_SETTINGS = 0x01
 WRITE_USB_MANUFACTURER_DESCRIPTOR_STRING = 0x02
 WRITE_USB_PRODUCT_DESCRIPTOR_STRING = 0x03
@@ -28,6 +45,9 @@ READ_USB_PRODUCT_DESCRIPTOR_STRING = 0x03
 READ_USB_SERIAL_NUMBER_DESCRIPTOR_STRING = 0x04
 READ_CHIP_FACTORY_SERIAL_NUMBER = 0x05
 
+CHIP_SETTINGS_SIZE = 10     # Chip settings bytes (READ_CHIP_SETTINGS reply bytes 4-13)
+CHIP_SECURITY_MASK = 0b11   # Chip settings byte 0, chip security (unsecured/password/locked)
+
 SET_GPIO_OUTPUT_VALUES = 0x50
 GET_GPIO_VALUES = 0x51
 SET_SRAM_SETTINGS = 0x60
@@ -35,7 +55,109 @@ GET_SRAM_SETTINGS = 0x61
 
 CMD_RESET = 0x70
 
-class FlashError(Exception):
+STATUS_SET_PARAMETERS = 0x10
+I2C_CANCEL_TRANSFER = 0x10  # Byte 2 of STATUS_SET_PARAMETERS
+I2C_SET_SPEED = 0x20        # Byte 3 of STATUS_SET_PARAMETERS
+I2C_WRITE_DATA = 0x90
+I2C_WRITE_DATA_REPEATED_START = 0x92
+I2C_WRITE_DATA_NO_STOP = 0x94
+I2C_READ_DATA = 0x91
+I2C_READ_DATA_REPEATED_START = 0x93
+I2C_GET_DATA = 0x40
+I2C_MAX_CHUNK = 60  # Max. data bytes in one report
+
+# I2C engine states (status byte 8)
+I2C_STATE_IDLE = 0x00
+I2C_STATE_ADDRESS_NACK = 0x25
+I2C_STATE_PARTIAL_DATA = 0x41
+I2C_STATE_WRITING_NO_STOP = 0x45
+I2C_STATE_READ_PARTIAL = 0x54
+I2C_STATE_READ_COMPLETE = 0x55
+I2C_STATE_ERRORS = (0x12, 0x23, 0x44, 0x62)  # Start/address/data/stop timeouts
+I2C_ADDRESS_NACK_MASK = 0x40  # Status byte 20
+I2C_READ_ERROR = 0x7F  # Number of bytes in I2C_GET_DATA reply when read failed
+I2C_RETRY_MAX = 50
+I2C_BUSY_TIMEOUT = 0.1  # Seconds an I2C transfer may stay busy/pending before it is cancelled
+
+DEFAULT_TIMEOUT = 1000       # ms, reply timeout of every transaction (mcp2221a.timeout)
+DEFAULT_RETRIES = 2          # Retries of idempotent commands after a reply timeout (mcp2221a.retries)
+TRY_READ_TIMEOUT = 1         # ms, tryRead() (smallest timeout pyusb accepts, 0 would block forever)
+DRAIN_TIMEOUT = 5            # ms, waiting for late replies before a retry
+STALE_REPLIES_MAX = 8        # Replies to other commands discarded while waiting for a reply
+
+# GPx designation (bits 2-0 of GP setting)
+GP_DESIGNATION_GPIO = 0b000
+GP_DESIGNATION_ADC = 0b010  # GP1 - ADC1, GP2 - ADC2, GP3 - ADC3
+GP_DESIGNATION_DAC = 0b011  # GP2 - DAC1, GP3 - DAC2 (both output the same DAC value)
+GP_DESIGNATION_INTERRUPT = 0b100  # GP1 - Interrupt-on-change detection input
+DAC_MAX = 31  # 5 bit DAC
+
+# Voltage reference (bits 2-1: VRM level, bit 0: 0 - Vdd, 1 - VRM) for ADC/DAC settings in SET_SRAM_SETTINGS
+VREF = {'VDD': 0b000, '1.024': 0b011, '2.048': 0b101, '4.096': 0b111}
+
+def packetTemplate(*header):
+    # 64 byte report starting with header, rest is 0
+    buf = array.array('B', bytes(HID_PKT_SIZE))
+    buf[0:len(header)] = array.array('B', header)
+    return buf
+
+def dacPacket(value):
+    # Ready-to-send report setting DAC output to value (0-31)
+    if not 0 <= value <= DAC_MAX:
+        raise ValueError("DAC value out of range")
+    return packetTemplate(SET_SRAM_SETTINGS, 0x00, 0x00, 0x00, 0x80 | value)
+
+def gpioPacket(values):
+    # Ready-to-send report setting GPx as output with value values[x] (None - leave GPx untouched)
+    buf = packetTemplate(SET_GPIO_OUTPUT_VALUES)
+    for pin in range(4):
+        if values[pin] is None:
+            continue
+        buf[2+0 + pin*4] = 0xFF  # Alter GPx output
+        buf[2+1 + pin*4] = 1 if values[pin] else 0
+        buf[2+2 + pin*4] = 0xFF  # Alter GPx direction
+        buf[2+3 + pin*4] = 0x00  # Output
+    return buf
+
+# Precomputed reports for commands that never change
+EMPTY_PACKET = packetTemplate()
+STATUS_COMMAND = packetTemplate(0x10)
+RESET_COMMAND = packetTemplate(CMD_RESET, 0xAB, 0xCD, 0xEF)
+GET_GPIO_VALUES_COMMAND = packetTemplate(GET_GPIO_VALUES)
+GET_SRAM_SETTINGS_COMMAND = packetTemplate(GET_SRAM_SETTINGS)
+CLEAR_INTERRUPT_COMMAND = packetTemplate(SET_SRAM_SETTINGS, 0x00, 0x00, 0x00, 0x00, 0x00, 0x80 | 0x01)
+I2C_CANCEL_COMMAND = packetTemplate(STATUS_SET_PARAMETERS, 0x00, I2C_CANCEL_TRANSFER)
+I2C_GET_DATA_COMMAND = packetTemplate(I2C_GET_DATA)
+READ_FLASH_COMMANDS = [packetTemplate(CMD_READ, section) for section in range(6)]
+
+# Commands that can be sent again after a lost reply without side effects
+RETRYABLE_COMMANDS = frozenset([STATUS_SET_PARAMETERS, SET_GPIO_OUTPUT_VALUES, GET_GPIO_VALUES, SET_SRAM_SETTINGS,
+                                GET_SRAM_SETTINGS, CMD_READ])
+
+class MCP2221AError(IOError):
+    # Base of every error reported by the chip or the HID exchange
+    pass
+
+class ReplyTimeoutError(MCP2221AError, TimeoutError):
+    # No reply within the timeout (after retries)
+    pass
+
+class UnexpectedReplyError(MCP2221AError):
+    # Only replies to other commands arrived
+    pass
+
+class CommandError(MCP2221AError):
+    # Chip reported that the command failed
+    pass
+
+class GpioError(CommandError):
+    # GPx is not set for GPIO operation
+    pass
+
+class FlashError(MCP2221AError):
+    pass
+
+class I2CError(MCP2221AError):
     pass
 
 class ByteDecoder(object):
@@ -50,9 +172,7 @@ class HexDecoder(object):
         self.start = start
         self.end = end
     def value(self, data):
-        section = data[self.start:self.end]
-        section.reverse()
-        return ''.join('{:02x}'.format(x) for x in section)
+        return '%0*x' % (2*(self.end - self.start), int.from_bytes(data[self.start:self.end], 'little'))
 
 class BitDecoder(object):
     def __init__(self, byte, bit):
@@ -69,6 +189,7 @@ class EnumDecoder(object):
     def value(self, data):
         return self.opts[data[self.byte] & self.mask]
 
+# Kept for compatibility, readChipSettings() uses the compiled reportDecoder.CHIP_SETTINGS_DECODER
 CHIP_SETTINGS_MAP = {
     'Provide serial number on enumeration': BitDecoder(4, 7),
     'USB vendorID': HexDecoder(8, 10),
@@ -122,17 +243,182 @@ def getProduct(device):
     except ValueError:
         return ''
 
-class mcp2221a:
+def checkVref(vref):
+    if vref not in VREF:
+        raise ValueError("Voltage reference is one of " + ', '.join(VREF))
+
+class sramConfig(object):
+    # SRAM (runtime) settings changes collected for mcp2221a.configureSram(), which applies all of them
+    # in one SET_SRAM_SETTINGS report. Settings left None keep their current value. Methods can be chained:
+    #     mcp2221a.configureSram(sramConfig().output(0, 1).input(1).adc(2).dac(3).dacReference('2.048'))
+    def __init__(self):
+        self.designation = [None]*4
+        self.direction = [None]*4  # 0 - Output, 1 - Input
+        self.value = [None]*4      # Output value
+        self.dacVref = None        # VREF key ('VDD', '1.024', '2.048', '4.096')
+        self.adcVref = None
+        self.dacValue = None
+        self.clockOutput = None    # Bits 4-3 duty cycle, bits 2-0 divider
+        self.interruptPositive = None
+        self.interruptNegative = None
+        self.clearInterrupt = False
+
+    def pin(self, pin, designation=None, direction=None, value=None):
+        self.designation[pin] = designation
+        self.direction[pin] = direction
+        self.value[pin] = value
+        return self
+
+    def output(self, pin, value=0):
+        return self.pin(pin, GP_DESIGNATION_GPIO, 0, 1 if value else 0)
+
+    def input(self, pin):
+        return self.pin(pin, GP_DESIGNATION_GPIO, 1, 0)
+
+    def adc(self, channel):
+        # ADC channel x is on GPx (1-3)
+        if channel not in (1, 2, 3):
+            raise ValueError("ADC channels are 1-3")
+        return self.pin(channel, GP_DESIGNATION_ADC, 1)
+
+    def dac(self, pin):
+        if pin not in (2, 3):
+            raise ValueError("DAC outputs are GP2 and GP3")
+        return self.pin(pin, GP_DESIGNATION_DAC)
+
+    def dacReference(self, vref):
+        checkVref(vref)
+        self.dacVref = vref
+        return self
+
+    def adcReference(self, vref):
+        checkVref(vref)
+        self.adcVref = vref
+        return self
+
+    def dacOutput(self, value):
+        if not 0 <= value <= DAC_MAX:
+            raise ValueError("DAC value out of range")
+        self.dacValue = value
+        return self
+
+    def clock(self, divider, dutyCycle=0b01):
+        # Clock output on GP1 (designation 0b001): 48 MHz / 2**divider (divider 1-7), duty cycle 0-3 (0%-75%)
+        self.clockOutput = ((dutyCycle & 0x03) << 3) | (divider & 0x07)
+        return self
+
+    def interrupt(self, positive=None, negative=None):
+        # Interrupt-on-change detection of GP1 edges (GP1 designation GP_DESIGNATION_INTERRUPT, see interruptPin())
+        self.interruptPositive = positive
+        self.interruptNegative = negative
+        return self
 
+    def interruptPin(self):
+        return self.pin(1, GP_DESIGNATION_INTERRUPT, 1)
 
+    def clearInterruptFlag(self):
+        self.clearInterrupt = True
+        return self
+
+class transport(object):
+    # Moves 64 byte HID reports between the host and a MCP2221A.
+    # Subclasses: usbTransport (real chip through pyusb), emulator.mcp2221aEmulator (software chip)
+    usbDevice = None
+
+    def write(self, buf):
+        raise NotImplementedError
+
+    def read(self, timeout=None):
+        # timeout - ms, None - transport default. Raises TimeoutError (or pyusb USBTimeoutError) if no reply came
+        raise NotImplementedError
+
+    def readInto(self, buf, timeout=None):
+        # Read reply into caller owned buffer (array of HID_PKT_SIZE bytes)
+        reply = self.read(timeout)
+        memoryview(buf)[:len(reply)] = reply
+        return len(reply)
+
+    def tryReadInto(self, buf, timeout=None):
+        # Poll for a reply (mcp2221a.tryRead()), a timeout only means there is no reply yet: transport wrappers
+        # do not count it as a lost request
+        return self.readInto(buf, timeout)
+
+    def reconnect(self):
+        # Called after CMD_RESET, must return once the chip can be used again
+        raise NotImplementedError
+
+class hotplugWaiter(object):
+    # Wakes reconnect() up as soon as a MCP2221A is attached (libusb hotplug through the optional python-libusb1),
+    # without hotplug support it just sleeps
     def __init__(self):
-        self.usbDevice = 0
-        self.getUsbDevice()
+        self.context = None
+        if usb1 is not None:
+            context = usb1.USBContext()
+            if context.hasCapability(usb1.CAP_HAS_HOTPLUG):
+                context.hotplugRegisterCallback(self.arrived, events=usb1.HOTPLUG_EVENT_DEVICE_ARRIVED,
+                                                vendor_id=USB_VENDOR_ID, product_id=USB_PRODUCT_ID)
+                self.context = context
+            else:
+                context.close()
 
-    def getUsbDevice(self):
-        self.usbDevice = usb.core.find(idVendor=0x4d8, idProduct=0xdd)
-        if self.usbDevice is None:
+    def arrived(self, context, device, event):
+        return False  # Stay registered
+
+    def wait(self, timeout):
+        if self.context is None:
+            time.sleep(timeout)
+        else:
+            self.context.handleEventsTimeout(tv=timeout)
+
+    def close(self):
+        if self.context is not None:
+            self.context.close()
+
+class usbTransport(transport):
+    def __init__(self, usbDevice=None, serial=None, portPath=None):
+        # serial, portPath - open this chip (USB serial number string, (bus, port, port, ...)), default first found
+        self.usbDevice = usbDevice
+        self.serial = serial
+        self.portPath = portPath
+        self.address = None
+        if usbDevice is None:
+            self.open()
+        else:
+            # Device found by the caller (deviceManager), the kernel driver still has to be detached
+            self.claim()
+            self.identify()
+
+    def identify(self):
+        # Remember which physical chip this is, reconnect() re-attaches to the same one after reset.
+        # Port path costs nothing, serial number string is only read when the backend has no port numbers.
+        self.address = (self.usbDevice.bus, self.usbDevice.address)
+        if self.usbDevice.port_numbers:
+            self.portPath = (self.usbDevice.bus,) + tuple(self.usbDevice.port_numbers)
+        elif self.serial is None and self.usbDevice.iSerialNumber:
+            self.serial = usb.util.get_string(self.usbDevice, self.usbDevice.iSerialNumber)
+
+    def matches(self, usbDevice):
+        if self.portPath is not None and usbDevice.port_numbers:
+            return (usbDevice.bus,) + tuple(usbDevice.port_numbers) == self.portPath
+        if self.serial is not None:
+            try:
+                return bool(usbDevice.iSerialNumber) and \
+                    usb.util.get_string(usbDevice, usbDevice.iSerialNumber) == self.serial
+            except (usb.core.USBError, ValueError):
+                return False
+        return True
+
+    def open(self):
+        for record in usbIndex.defaultIndex().find(USB_VENDOR_ID, USB_PRODUCT_ID):
+            if self.matches(record.usbDevice):
+                self.usbDevice = record.usbDevice
+                break
+        else:
             raise ValueError('No MCP2221A device found')
+        self.claim()
+        self.identify()
+
+    def claim(self):
         # self.usbDevice.reset() # try this line if shiz isnt working
 
         # print(self.usbDevice)
@@ -148,140 +434,347 @@ class mcp2221a:
             raise ValueError(tracebackStr)
         # self.usbDevice.set_configuration() #  try this line if shiz isnt working
 
-    def resetChip(self):
-        # Max power-up time 140ms
-        buf = [0]*64
-        buf[0] = CMD_RESET
-        buf[1] = 0xAB
-        buf[2] = 0xCD
-        buf[3] = 0xEF
+    def write(self, buf):
         self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        time.sleep(1)
-        self.getUsbDevice()
+
+    def read(self, timeout=None):
+        return self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE, timeout)
+
+    def readInto(self, buf, timeout=None):
+        # pyusb reads straight into an array.array, no new buffer is allocated
+        return self.usbDevice.read(INPUT_ENDPOINT, buf, timeout)
+
+    def ready(self, usbDevice):
+        # Claim re-enumerated chip and check that it answers a status command
+        self.usbDevice = usbDevice
+        try:
+            self.claim()
+            usbDevice.write(OUTPUT_ENDPOINT, STATUS_COMMAND, RECONNECT_STATUS_TIMEOUT)
+            reply = usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE, RECONNECT_STATUS_TIMEOUT)
+        except (usb.core.USBError, ValueError):
+            return False
+        return reply[0] == STATUS_SET_PARAMETERS
+
+    def reconnect(self, timeout=RECONNECT_TIMEOUT):
+        # Wait until the same chip re-enumerates after reset (max power-up time 140ms).
+        # Polls with exponential backoff, hotplug events end the wait early. The old USB address is skipped,
+        # the chip gets a new one when it re-enumerates.
+        deadline = time.perf_counter() + timeout
+        oldAddress = self.address
+        usb.util.dispose_resources(self.usbDevice)
+        waiter = hotplugWaiter()
+        delay = RECONNECT_POLL_MIN
+        try:
+            while True:
+                for usbDevice in usb.core.find(find_all=True, idVendor=USB_VENDOR_ID, idProduct=USB_PRODUCT_ID):
+                    if (usbDevice.bus, usbDevice.address) != oldAddress and self.matches(usbDevice) and \
+                            self.ready(usbDevice):
+                        self.identify()
+                        usbIndex.defaultIndex().invalidate()  # Cached device list has the old address
+                        return
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise IOError('MCP2221A did not re-enumerate within %.1f s' % timeout)
+                waiter.wait(min(delay, remaining))
+                delay = min(2*delay, RECONNECT_POLL_MAX)
+        finally:
+            waiter.close()
+
+class mcp2221a:
+
+
+    def __init__(self, transport=None, shared=False):
+        # transport - None to open the first MCP2221A found on USB, or any transport instance
+        #             (for example emulator.mcp2221aEmulator())
+        # shared    - other clients use the same chip (deviceDaemon), so GP shadows and flash cache can be stale:
+        #             GP writes are never skipped and flash is always read from the chip
+        self.usbDevice = 0
+        self.transport = transport
+        self.shared = shared
+        self.metrics = None  # metrics.commandMetrics when enabled (enableMetrics())
+        # Reports are built in txBuf and replies are read into rxBuf, both are reused by every command
+        self.txBuf = array.array('B', EMPTY_PACKET)
+        self.txView = memoryview(self.txBuf)
+        self.rxBuf = array.array('B', EMPTY_PACKET)
+        self.flashImage = dict()  # Cached readFlash() replies, key is the flash section
+        self.i2cAbortRequest = False  # Set by i2cAbort() (from any thread) to stop the running I2C transfer
+        self.gpOutputShadow = [None]*4     # Last output value written to GPx, None if unknown
+        self.gpDirectionShadow = [None]*4  # Last direction of GPx (0 - Output, 1 - Input), None if unknown
+        self.resetLatency = None  # Seconds the last resetChip() took until the chip answered again
+        self.timeout = DEFAULT_TIMEOUT  # ms, reply timeout of transfer()
+        self.retries = DEFAULT_RETRIES  # Retries of RETRYABLE_COMMANDS after a reply timeout
+        self.staleReplies = 0  # Late replies (to earlier, timed out requests) discarded so far
+        if transport is None:
+            self.getUsbDevice()
+        else:
+            self.usbDevice = transport.usbDevice
+
+    def getUsbDevice(self):
+        recorder = self.unwrapTransport(capture.captureTransport)
+        self.transport = usbTransport()
+        self.usbDevice = self.transport.usbDevice
+        # Re-opened device keeps capture/metrics wrappers
+        if recorder is not None:
+            recorder.transport = self.transport
+            self.transport = recorder
+        if self.metrics is not None:
+            self.transport = metrics.metricsTransport(self.transport, self.metrics)
+
+    def enableMetrics(self, commandMetrics=None):
+        # Record per-command latency, timeouts and error replies (metrics.commandMetrics, can be shared by devices)
+        # Start samplers/players/async API after enabling, they bind the transport when they start
+        if self.metrics is None:
+            self.metrics = commandMetrics or metrics.commandMetrics()
+            self.transport = metrics.metricsTransport(self.transport, self.metrics)
+        return self.metrics
+
+    def disableMetrics(self):
+        if self.metrics is not None:
+            self.unwrapTransport(metrics.metricsTransport)
+            self.metrics = None
+
+    def startCapture(self, path, flushEvery=1):
+        # Append every transaction to capture file path (see capture.py), replay with capture.replayTransport
+        self.stopCapture()
+        self.transport = capture.captureTransport(self.transport, path, flushEvery)
+        return self.transport
+
+    def stopCapture(self):
+        wrapper = self.unwrapTransport(capture.captureTransport)
+        if wrapper is not None:
+            wrapper.close()
+
+    def unwrapTransport(self, wrapperClass):
+        # Remove wrapper (metrics, capture) of wrapperClass from the transport chain, returns it
+        outer = None
+        current = self.transport
+        while isinstance(current, (metrics.metricsTransport, capture.captureTransport)):
+            if isinstance(current, wrapperClass):
+                if outer is None:
+                    self.transport = current.transport
+                else:
+                    outer.transport = current.transport
+                return current
+            outer = current
+            current = current.transport
+        return None
+
+    def newPacket(self, cmd):
+        # Clear txBuf and start a new report
+        self.txBuf[:] = EMPTY_PACKET
+        self.txBuf[0] = cmd
+        return self.txBuf
+
+    def transfer(self, buf, timeout=None, retries=None):
+        # Send one report and return the reply
+        # Note that reply is rxBuf, it is only valid until the next transfer()
+        # timeout - ms (None - self.timeout)
+        # retries - times the report is sent again after a reply timeout (None - self.retries for
+        #           RETRYABLE_COMMANDS, 0 for commands with side effects)
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries if buf[0] in RETRYABLE_COMMANDS else 0
+        attempt = 0
+        while True:
+            self.transport.write(buf)
+            try:
+                return self.readReply(buf[0], timeout)
+            except ReplyTimeoutError:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                self.drain()
+
+    def readReply(self, cmd, timeout):
+        # Read the reply to cmd into rxBuf, replies to other commands (late replies of timed out requests)
+        # are discarded
+        for i in range(STALE_REPLIES_MAX):
+            try:
+                self.transport.readInto(self.rxBuf, timeout)
+            except Exception as e:
+                if metrics.isTimeout(e):
+                    raise ReplyTimeoutError('No reply to command 0x%02x within %u ms' % (cmd, timeout))
+                raise
+            if self.rxBuf[0] == cmd:
+                return self.rxBuf
+            self.staleReplies += 1
+        raise UnexpectedReplyError('No reply to command 0x%02x, only replies to other commands' % cmd)
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        # Discard replies still on the way (late replies of timed out requests), returns their number
+        drained = 0
+        while self.tryRead(timeout=timeout) is not None:
+            drained += 1
+        self.staleReplies += drained
+        return drained
+
+    def post(self, buf):
+        # Send report without waiting for the reply, collect it with tryRead()
+        self.transport.write(buf)
+
+    def tryRead(self, cmd=None, timeout=TRY_READ_TIMEOUT):
+        # Non-blocking read for pollers: reply in rxBuf, or None if there is none yet
+        # cmd - expected command, a reply to another command is discarded (and None returned)
+        try:
+            self.transport.tryReadInto(self.rxBuf, timeout)
+        except Exception as e:
+            if metrics.isTimeout(e):
+                return None
+            raise
+        if cmd is not None and self.rxBuf[0] != cmd:
+            self.staleReplies += 1
+            return None
+        return self.rxBuf
+
+    def checkStatus(self, info, what):
+        # Raise CommandError if reply status byte reports failure
+        if info[1] != 0x00:
+            raise CommandError('%s failed (status 0x%02x)' % (what, info[1]))
+
+    def resetChip(self):
+        # Returns once the chip answers again (same physical chip), resetLatency is the time it took [s]
+        start = time.perf_counter()
+        self.transport.write(RESET_COMMAND)
+        self.transport.reconnect()
+        self.resetLatency = time.perf_counter() - start
+        self.usbDevice = self.transport.usbDevice
+        self.invalidateFlashCache()
+        self.invalidateGpShadow()
+        return self.resetLatency
+
+    def invalidateFlashCache(self):
+        self.flashImage.clear()
+
+    def invalidateGpShadow(self):
+        self.gpOutputShadow = [None]*4
+        self.gpDirectionShadow = [None]*4
+
+    def updateGpShadow(self, gpSettings):
+        # gpSettings - GP0..GP3 setting bytes just written to SRAM (same format as gpSetting_U.R)
+        for pin in range(4):
+            if gpSettings[pin] & 0x07:  # Not GPIO operation, chip will answer 0xEE
+                self.gpOutputShadow[pin] = None
+                self.gpDirectionShadow[pin] = None
+            else:
+                self.gpOutputShadow[pin] = (gpSettings[pin] >> 4) & 1
+                self.gpDirectionShadow[pin] = (gpSettings[pin] >> 3) & 1
 
     def writeFlash(self, data):
-        buf = [0]*64
-        buf[0] = CMD_WRITE
-        for i in range(len(data)):
-            buf[i+1] = data[i]
+        # data - flash write sub-command followed by its payload (report without the leading CMD_WRITE)
+        self.newPacket(CMD_WRITE)
+        self.txView[1:1 + len(data)] = array.array('B', data)
+        return self.writeFlashPacket()
+
+    def writeFlashPacket(self):
+        # Send write flash command already built in txBuf
+        # Whatever gets written, cached flash image is not valid anymore
+        self.invalidateFlashCache()
         # self.usbDevice.write(OUTPUT_ENDPOINT, '\xB1' + data)
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        assert info[0] == CMD_WRITE
+        info = self.transfer(self.txBuf)
         if info[1] == 0x02:
             raise FlashError('Command not supported')
         if info[1] == 0x03:
             raise FlashError('Command not allowed')
 
     def writeDescriptor(self, name, descriptor):
-        # Note that buf is sifted for 1 byte
-        buf = [0]*63
+        buf = self.newPacket(CMD_WRITE)
         if descriptor == "Product":
-            buf[0] = WRITE_USB_PRODUCT_DESCRIPTOR_STRING
+            buf[1] = WRITE_USB_PRODUCT_DESCRIPTOR_STRING
         elif descriptor == "Manufacturer":
-            buf[0] = WRITE_USB_MANUFACTURER_DESCRIPTOR_STRING
+            buf[1] = WRITE_USB_MANUFACTURER_DESCRIPTOR_STRING
         elif descriptor == "Serial":
-            buf[0] = WRITE_USB_SERIAL_NUMBER_DESCRIPTOR_STRING
+            buf[1] = WRITE_USB_SERIAL_NUMBER_DESCRIPTOR_STRING
         else:
-            assert 0
-        buf[1] = (2*len(name))+2  # Number of bytes + 2 in the provided USB Serial Number Descriptor String
-        buf[2] = 0x03
-
-        for i in range(len(name)):
-            buf[i*2 + 0 + 3] = ord(name[i])  # ord() converts "A" to 'A' (from string to C like char)
-            buf[i*2 + 1 + 3] = 0
+            raise ValueError('Unknown descriptor ' + repr(descriptor))
+        data = name.encode('utf-16-le')
+        if len(data) > 60:
+            raise ValueError("Descriptor string is too long (max 30 characters)")
+        buf[2] = len(data) + 2  # Number of bytes + 2 in the provided USB Serial Number Descriptor String
+        buf[3] = 0x03
+        self.txView[4:4 + len(data)] = data
 
-        return self.writeFlash(buf)
+        return self.writeFlashPacket()
 
     def writeFlashGpSettings(self, gpSettings):
         # First readFlashGpSettings() and than only set the GPx parameters you want to change
+        buf = self.newPacket(CMD_WRITE)
+        buf[1] = WRITE_GP_SETTINGS
+        self.txView[2:6] = gpSettings.R.to_bytes(4, 'little')  # GP0..GP3 settings
 
-        # Note that buf is sifted for 1 byte
-        buf = [0]*63
-        buf[0] = WRITE_GP_SETTINGS
-        buf[1] = gpSettings.B.GP0.R  # GP0 settings
-        buf[2] = gpSettings.B.GP1.R  # GP1 settings
-        buf[3] = gpSettings.B.GP2.R  # GP2 settings
-        buf[4] = gpSettings.B.GP3.R  # GP3 settings
+        return self.writeFlashPacket()
 
-        return self.writeFlash(buf)
+    def writeFlashChipSettings(self, chipSettings, password=bytes(8)):
+        # chipSettings - 10 bytes as in READ_CHIP_SETTINGS reply (bytes 4-13)
+        # Chip security bits are always kept as they are in flash, this never locks or unlocks the chip
+        current = self.readFlash(READ_CHIP_SETTINGS)
+        data = bytearray(chipSettings)
+        if len(data) != CHIP_SETTINGS_SIZE:
+            raise ValueError("Chip settings are %u bytes" % CHIP_SETTINGS_SIZE)
+        if len(password) != 8:
+            raise ValueError("Password is 8 bytes")
+        data[0] = (data[0] & ~CHIP_SECURITY_MASK) | (current[4] & CHIP_SECURITY_MASK)
+        return self.writeFlash(bytes([WRITE_CHIP_SETTINGS]) + data + bytes(password))
 
-    def readFlash(self, section):
+    def readFlash(self, section, cached=True):
+        # Flash only changes through writeFlash()/resetChip(), so every section is read from the chip only once
+        if cached and not self.shared and section in self.flashImage:
+            return self.flashImage[section]
+
+        if not 0 <= section < len(READ_FLASH_COMMANDS):
+            raise ValueError('Unknown flash section %r' % section)
         # device.write(OUTPUT_ENDPOINT, '\xB0' + section + ('\x00' * 62))
-        buf = [0]*64
-        buf[0] = CMD_READ
-        buf[1] = section
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        assert info[0] == CMD_READ
+        info = self.transfer(READ_FLASH_COMMANDS[section])
         if info[1] != 0x00:
             raise FlashError('Command not supported')
+        # Copy, rxBuf is reused by the next transfer
+        info = info.tobytes()
+        self.flashImage[section] = info
         return info
 
     def readFlashGpSettings(self):
         response = self.readFlash(READ_GP_SETTINGS)
-
-        gpSettings = gpSettings_U()
-        gpSettings.B.GP0.R = response[4]
-        gpSettings.B.GP1.R = response[5]
-        gpSettings.B.GP2.R = response[6]
-        gpSettings.B.GP3.R = response[7]
-
-        return gpSettings
+        return gpSettings_U.from_buffer_copy(response, 4)
 
     def readChipSettings(self):
         chip_settings = self.readFlash(READ_CHIP_SETTINGS)
-        output = dict()
-        for attr in CHIP_SETTINGS_MAP:
-            output[attr] = CHIP_SETTINGS_MAP[attr].value(chip_settings)
-        return output
+        return reportDecoder.CHIP_SETTINGS_DECODER.decode(chip_settings)
 
-    def readUsbManufacturerDescriptorString(self):
-        response = self.readFlash(READ_USB_MANUFACTURER_DESCRIPTOR_STRING)
-        nameLen = int((response[2] - 2) / 2)
-        assert response[3] == 0x03  # This value must always be 0x03
-        usbManufacturerDescriptorString = ""
-        for i in range(nameLen):
-            usbManufacturerDescriptorString += chr(response[4 + i*2])
+    def readDescriptorString(self, section):
+        response = self.readFlash(section)
+        if response[3] != 0x03:  # This value must always be 0x03
+            raise FlashError('Invalid descriptor string in flash section %u' % section)
+        return codecs.decode(memoryview(response)[4:2 + response[2]], 'utf-16-le')
 
-        return usbManufacturerDescriptorString
+    def readUsbManufacturerDescriptorString(self):
+        return self.readDescriptorString(READ_USB_MANUFACTURER_DESCRIPTOR_STRING)
 
     def readUsbProductDescriptorString(self):
-        response = self.readFlash(READ_USB_PRODUCT_DESCRIPTOR_STRING)
-        nameLen = int((response[2] - 2) / 2)
-        assert response[3] == 0x03  # This value must always be 0x03
-        usbProductDescriptorString = ""
-        for i in range(nameLen):
-            usbProductDescriptorString += chr(response[4 + i*2])
-
-        return usbProductDescriptorString
+        return self.readDescriptorString(READ_USB_PRODUCT_DESCRIPTOR_STRING)
 
     def readUsbSerialNumberDescriptorString(self):
-        response = self.readFlash(READ_USB_SERIAL_NUMBER_DESCRIPTOR_STRING)
-        nameLen = int((response[2] - 2) / 2)
-        assert response[3] == 0x03  # This value must always be 0x03
-        usbSerialNumberDescriptorString = ""
-        for i in range(nameLen):
-            usbSerialNumberDescriptorString += chr(response[4 + i*2])
-
-        return usbSerialNumberDescriptorString
+        return self.readDescriptorString(READ_USB_SERIAL_NUMBER_DESCRIPTOR_STRING)
 
     def readChipFactorySerialNumber(self):
         response = self.readFlash(READ_CHIP_FACTORY_SERIAL_NUMBER)
-        structureLen = response[2]
-        chipFactorySerialNumber = ""
-        for i in range(structureLen):
-            chipFactorySerialNumber += chr(response[4 + i])
-
-        return chipFactorySerialNumber
+        return codecs.decode(memoryview(response)[4:4 + response[2]], 'latin-1')
 
     def getStatus(self):
-        self.usbDevice.write(OUTPUT_ENDPOINT, STATUS_COMMAND)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        assert info[0] == 0x10
+        # Only the status command is sent every call, flash sections come from the cached flash image
+        return self.getSnapshot()
+
+    def getSnapshot(self, refresh=False):
+        # Decoded view of status and flash contents
+        # refresh - re-read flash sections from the chip instead of using the cached flash image
+        if refresh:
+            self.invalidateFlashCache()
+        info = self.transfer(STATUS_COMMAND)
+        # Decode before reading flash, reading flash reuses rxBuf
+        status = reportDecoder.STATUS_DECODER.decode(info)
         output = {
-            'MCP2221A HW revision': chr(info[46]) + chr(info[47]),
-            'MCP2221A Firmware revision': chr(info[48]) + chr(info[49]),
+            'MCP2221A HW revision': status['MCP2221A HW revision'],
+            'MCP2221A Firmware revision': status['MCP2221A Firmware revision'],
+            'ADC channel values': [status['ADC channel 1'], status['ADC channel 2'], status['ADC channel 3']],
             'USB Manufacturer Descriptor String': self.readUsbManufacturerDescriptorString(),
             'USB Product Descriptor String': self.readUsbProductDescriptorString(),
             'USB Serial Number Descriptor String': self.readUsbSerialNumberDescriptorString(),
@@ -292,110 +785,364 @@ class mcp2221a:
         output.update(chip_settings)
         return output
 
+    def i2cStatus(self):
+        # Status report with I2C engine state, reply is only valid until the next transfer
+        return self.transfer(STATUS_COMMAND)
+
+    def i2cSetSpeed(self, speed=100000):
+        # speed - I2C clock [Hz], 46875 - 400000
+        divider = 12000000 // speed - 3
+        if not 0 < divider < 256:
+            raise ValueError("I2C speed out of range")
+        buf = self.newPacket(STATUS_SET_PARAMETERS)
+        buf[3] = I2C_SET_SPEED
+        buf[4] = divider
+        info = self.transfer(buf)
+        if info[3] != I2C_SET_SPEED:
+            # Chip refuses to change speed while a transfer is in progress
+            raise I2CError('I2C speed not set, transfer in progress')
+
+    def i2cCancel(self):
+        # Cancel current I2C transfer, chip also tries to free the bus
+        info = self.transfer(I2C_CANCEL_COMMAND)
+        return info[2]  # 0x10 - Transfer marked for cancellation, 0x11 - Already idle
+
+    def i2cRecover(self):
+        # Bring the I2C engine back to idle after a hung transfer (e.g. slave holding SDA low)
+        for i in range(I2C_RETRY_MAX):
+            if self.i2cCancel() == 0x11:
+                break
+        state = self.i2cStatus()[8]
+        if state != I2C_STATE_IDLE:
+            raise I2CError('I2C engine did not return to idle (state 0x%02x)' % state)
+        self.i2cAbortRequest = False
+
+    def i2cAbort(self):
+        # Request the running i2cWrite()/i2cRead() (in another thread) to stop between chunks
+        self.i2cAbortRequest = True
+
+    def i2cCheckAbort(self):
+        if self.i2cAbortRequest:
+            self.i2cAbortRequest = False
+            self.i2cCancel()
+            raise I2CError('I2C transfer aborted')
+
+    def i2cWaitIdle(self, cmd):
+        # Poll status until the transfer is done, raise on NACK/timeouts
+        deadline = time.perf_counter() + I2C_BUSY_TIMEOUT
+        while time.perf_counter() < deadline:
+            info = self.i2cStatus()
+            state = info[8]
+            if info[20] & I2C_ADDRESS_NACK_MASK or state == I2C_STATE_ADDRESS_NACK:
+                self.i2cCancel()
+                raise I2CError('I2C slave address was NACKed')
+            if state == I2C_STATE_IDLE:
+                return
+            if state == I2C_STATE_WRITING_NO_STOP and cmd == I2C_WRITE_DATA_NO_STOP:
+                return
+            if state in I2C_STATE_ERRORS:
+                self.i2cCancel()
+                raise I2CError('I2C bus timeout (state 0x%02x)' % state)
+            self.i2cCheckAbort()
+        self.i2cCancel()
+        raise I2CError('I2C transfer did not finish')
+
+    def i2cWrite(self, address, data, cmd=I2C_WRITE_DATA):
+        # address - 7 bit slave address
+        # data    - up to 65535 bytes, streamed in I2C_MAX_CHUNK byte reports
+        # Status is only polled when the chip reports busy and once at the end of the transfer
+        length = len(data)
+        if length >= 0x10000:
+            raise ValueError("I2C transfer too long")
+        data = memoryview(bytes(data))
+        offset = 0
+        while True:
+            chunk = data[offset:offset + I2C_MAX_CHUNK]
+            buf = self.newPacket(cmd)
+            buf[1] = length & 0xFF
+            buf[2] = length >> 8
+            buf[3] = address << 1
+            self.txView[4:4 + len(chunk)] = chunk
+            deadline = time.perf_counter() + I2C_BUSY_TIMEOUT
+            while True:
+                info = self.transfer(buf)
+                if info[1] == 0x00:
+                    break
+                # I2C engine still busy with the previous chunk
+                if info[2] in I2C_STATE_ERRORS or info[2] == I2C_STATE_ADDRESS_NACK:
+                    self.i2cCancel()
+                    raise I2CError('I2C write failed (state 0x%02x)' % info[2])
+                if time.perf_counter() > deadline:
+                    self.i2cCancel()
+                    raise I2CError('I2C write: engine busy')
+                self.i2cCheckAbort()
+            offset += len(chunk)
+            if offset >= length:
+                break
+            self.i2cCheckAbort()
+        self.i2cWaitIdle(cmd)
+
+    def i2cRead(self, address, length, cmd=I2C_READ_DATA):
+        # Returns bytearray of length bytes read from 7 bit slave address
+        if not 0 < length < 0x10000:
+            raise ValueError("I2C transfer length out of range")
+        buf = self.newPacket(cmd)
+        buf[1] = length & 0xFF
+        buf[2] = length >> 8
+        buf[3] = (address << 1) | 0x01
+        info = self.transfer(buf)
+        if info[1] != 0x00:
+            self.i2cCancel()
+            raise I2CError('I2C read not accepted (state 0x%02x)' % info[2])
+
+        data = bytearray(length)
+        view = memoryview(data)
+        received = 0
+        deadline = time.perf_counter() + I2C_BUSY_TIMEOUT
+        while received < length:
+            info = self.transfer(I2C_GET_DATA_COMMAND)
+            if info[2] == I2C_STATE_ADDRESS_NACK:
+                self.i2cCancel()
+                raise I2CError('I2C slave address was NACKed')
+            count = info[3]
+            if info[1] != 0x00 or count == 0:
+                # Data not yet read from the slave
+                if count == I2C_READ_ERROR and info[1] == 0x00:
+                    self.i2cCancel()
+                    raise I2CError('I2C read error')
+                if time.perf_counter() > deadline:
+                    self.i2cCancel()
+                    raise I2CError('I2C read timeout')
+                self.i2cCheckAbort()
+                continue
+            count = min(count, length - received)
+            view[received:received + count] = memoryview(info)[4:4 + count]
+            received += count
+            deadline = time.perf_counter() + I2C_BUSY_TIMEOUT
+            self.i2cCheckAbort()
+        return data
+
+    def i2cWriteRead(self, address, data, length):
+        # Write data, then read length bytes after a repeated start (e.g. register/EEPROM address, then data)
+        self.i2cWrite(address, data, I2C_WRITE_DATA_NO_STOP)
+        return self.i2cRead(address, length, I2C_READ_DATA_REPEATED_START)
+
+    def i2cScan(self, start=0x08, end=0x77):
+        # Addresses that ACK a zero length write
+        found = []
+        for address in range(start, end + 1):
+            try:
+                self.i2cWrite(address, b'')
+            except I2CError:
+                continue
+            found.append(address)
+        return found
+
+    def readSramSettings(self):
+        # Raw GET_SRAM_SETTINGS reply (bytes)
+        return self.transfer(GET_SRAM_SETTINGS_COMMAND).tobytes()
+
+    def readSramSettingsDecoded(self):
+        # Decoded GET_SRAM_SETTINGS reply (chip settings and GP0..GP3 settings)
+        return reportDecoder.SRAM_SETTINGS_DECODER.decode(self.transfer(GET_SRAM_SETTINGS_COMMAND))
+
+    def decodeStatus(self, info):
+        # Every field of a status reply (I2C engine state, SCL/SDA, interrupt flag, revisions, ADC values)
+        return reportDecoder.STATUS_DECODER.decode(info)
+
     def getSramSettings(self):
-        buf = [0]*64
-        buf[0] = GET_SRAM_SETTINGS
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        print("GP0: " + hex(info[22]) + ", GP1: " + hex(info[23]) + ", GP2: " + hex(info[24]) + ", GP3: " + hex(info[25]))
-        assert info[0] == GET_SRAM_SETTINGS
-        return
+        # Decoded SRAM (runtime) settings, same as readSramSettingsDecoded()
+        return self.readSramSettingsDecoded()
 
-    def setSramSettings(self):
-        buf = [0]*64
-        buf[0] = SET_SRAM_SETTINGS
-        # buf[0] = 0x60
-        buf[1] = 0x00  # Not care about this byte
-        buf[7] = 0x80  # Alter GPIO configuration
-        buf[8 + 0] = 0x10  # Alter GPx output (enable/disable)
-        buf[8 + 1] = 0x10  # Alter GPx output (enable/disable)
-        buf[8 + 2] = 0x17  # Alter GPx output (enable/disable)
-        buf[8 + 3] = 0x17  # Alter GPx output (enable/disable)
-        print("buf: " + str(buf))
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        print("info: " + str(info))
-        assert info[0] == SET_SRAM_SETTINGS
-        assert info[1] == 0x00  # Command completed successfully
+    def configureSram(self, config, current=None):
+        # Apply sramConfig: current SRAM settings are read once (or given as GET_SRAM_SETTINGS reply in current),
+        # every change goes out in one SET_SRAM_SETTINGS report. Returns False if nothing had to change.
+        if current is None:
+            current = self.readSramSettings()
+        buf = self.newPacket(SET_SRAM_SETTINGS)
+        changed = False
+
+        gpSettings = bytearray(current[22:26])
+        for pin in range(4):
+            for field, shift, mask in ((config.designation, 0, 0x07), (config.direction, 3, 0x01),
+                                       (config.value, 4, 0x01)):
+                if field[pin] is not None:
+                    gpSettings[pin] = (gpSettings[pin] & ~(mask << shift)) | ((field[pin] & mask) << shift)
+        gpChanged = gpSettings != current[22:26]
+
+        dacVref = (current[6] >> 5) & 0x07
+        adcVref = (current[7] >> 2) & 0x07
+        if gpChanged or (config.dacVref is not None and VREF[config.dacVref] != dacVref):
+            # Chip reloads voltage references when GP designation changes, so both are always written with it
+            buf[3] = 0x80 | (VREF[config.dacVref] if config.dacVref is not None else dacVref)
+            changed = True
+        if gpChanged or (config.adcVref is not None and VREF[config.adcVref] != adcVref):
+            buf[5] = 0x80 | (VREF[config.adcVref] if config.adcVref is not None else adcVref)
+            changed = True
+        if gpChanged:
+            buf[7] = 0x80  # Alter GPIO configuration
+            self.txView[8:12] = gpSettings
+        if config.dacValue is not None:
+            # SRAM holds the power-up DAC value, not the current output, so the value is always written
+            buf[4] = 0x80 | config.dacValue
+            changed = True
+        if config.clockOutput is not None and config.clockOutput != current[5] & 0x1F:
+            buf[2] = 0x80 | config.clockOutput
+            changed = True
+        interrupt = 0
+        if config.interruptPositive is not None and config.interruptPositive != bool(current[7] & 0x40):
+            interrupt |= 0x10 | (0x08 if config.interruptPositive else 0)
+        if config.interruptNegative is not None and config.interruptNegative != bool(current[7] & 0x20):
+            interrupt |= 0x04 | (0x02 if config.interruptNegative else 0)
+        if interrupt:
+            buf[6] = 0x80 | interrupt
+        if config.clearInterrupt:
+            buf[6] |= 0x80 | 0x01  # Clear interrupt flag (edge settings stay as they are)
+        changed = changed or gpChanged or buf[6] != 0
+
+        if not changed:
+            return False
+        self.checkStatus(self.transfer(buf), 'Set SRAM settings')
+        if gpChanged:
+            self.updateGpShadow(gpSettings)
+        return True
+
+    def configureDac(self, pins=(2,), vref='VDD'):
+        # Set GPx (2 and/or 3) as DAC output and set DAC voltage reference ('VDD', '1.024', '2.048', '4.096')
+        config = sramConfig().dacReference(vref)
+        for pin in pins:
+            config.dac(pin)
+        return self.configureSram(config)
+
+    def writeDac(self, value):
+        if not 0 <= value <= DAC_MAX:
+            raise ValueError("DAC value out of range")
+        buf = self.newPacket(SET_SRAM_SETTINGS)
+        buf[4] = 0x80 | value  # Alter DAC output value
+        self.checkStatus(self.transfer(buf), 'Write DAC')
+
+    def decodeAdc(self, info):
+        # 10 bit ADC1..ADC3 values from status reply
+        return [info[50] | (info[51] << 8), info[52] | (info[53] << 8), info[54] | (info[55] << 8)]
+
+    def readAdc(self):
+        # ADC values come with the status report, conversion happens continuously on ADC designated pins
+        return self.decodeAdc(self.transfer(STATUS_COMMAND))
+
+    def configureAdc(self, channels=(1, 2, 3), vref='VDD'):
+        # Set GPx of every channel x (1-3) as ADC input and set ADC voltage reference ('VDD', '1.024', '2.048', '4.096')
+        # Other pins keep their SRAM settings, everything is sent in one SET_SRAM_SETTINGS report
+        config = sramConfig().adcReference(vref)
+        for channel in channels:
+            config.adc(channel)
+        return self.configureSram(config)
+
+    def readInterruptFlag(self):
+        # True if an interrupt-on-change edge was detected on GP1 since the flag was cleared
+        return self.transfer(STATUS_COMMAND)[24] != 0
+
+    def clearInterruptFlag(self):
+        self.checkStatus(self.transfer(CLEAR_INTERRUPT_COMMAND), 'Clear interrupt flag')
+
+    def setSramSettings(self, config=None):
+        # config - sramConfig to apply, None - GP0/GP1 GPIO outputs high, GP2/GP3 outputs high without designation
+        if config is None:
+            config = sramConfig().pin(0, GP_DESIGNATION_GPIO, 0, 1).pin(1, GP_DESIGNATION_GPIO, 0, 1)
+            config.pin(2, 0b111, 0, 1).pin(3, 0b111, 0, 1)
+        return self.configureSram(config)
 
     def setAllOutput(self):
-        buf = [0]*64
-        buf[0] = SET_SRAM_SETTINGS
-        # buf[0] = 0x60
-        buf[1] = 0x00  # Not care about this byte
-        buf[7] = 0x80  # Alter GPIO configuration
-        buf[8 + 0] = 0x00  # Alter GPx output (enable/disable)
-        buf[8 + 1] = 0x00  # Alter GPx output (enable/disable)
-        buf[8 + 2] = 0x00  # Alter GPx output (enable/disable)
-        buf[8 + 3] = 0x00  # Alter GPx output (enable/disable)
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        assert info[0] == SET_SRAM_SETTINGS
-        assert info[1] == 0x00  # Command completed successfully
+        config = sramConfig()
+        for pin in range(4):
+            config.output(pin, 0)
+        return self.configureSram(config)
 
     def setAllInput(self):
-        buf = [0]*64
-        buf[0] = SET_SRAM_SETTINGS
-        # buf[0] = 0x60
-        buf[1] = 0x00  # Not care about this byte
-        buf[7] = 0x80  # Alter GPIO configuration
-        buf[8 + 0] = 0x08  # Alter GPx output (enable/disable)
-        buf[8 + 1] = 0x08  # Alter GPx output (enable/disable)
-        buf[8 + 2] = 0x08  # Alter GPx output (enable/disable)
-        buf[8 + 3] = 0x08  # Alter GPx output (enable/disable)
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        assert info[0] == SET_SRAM_SETTINGS
-        assert info[1] == 0x00  # Command completed successfully
+        config = sramConfig()
+        for pin in range(4):
+            config.input(pin)
+        return self.configureSram(config)
 
     def writeGP(self, pin, st):
+        self.writeGPs([st if i == pin else None for i in range(4)])
+
+    def writeGPMask(self, mask, values):
+        # mask   - bit x set means GPx is written
+        # values - bit x is the new output value of GPx
+        self.writeGPs([(values >> pin) & 1 if mask & (1 << pin) else None for pin in range(4)])
+
+    def writeGPs(self, values, force=False):
+        # Set GPx as output with value values[x] (None - leave GPx untouched), all pins in one report
+        # Pins already known (shadow state) to be outputs with the same value are not written again,
+        # unless force is True (or the chip is shared)
         # buf[0] = WRITE_GP_SETTINGS
         # Writing 0 means nothing changes
-        buf = [0]*64
-        buf[0] = SET_GPIO_OUTPUT_VALUES
+        force = force or self.shared
+        buf = self.newPacket(SET_GPIO_OUTPUT_VALUES)
         buf[1] = 0x00  # Not care about this byte
-        buf[2+0 + pin*4] = 0xFF  # Alter GPx output (enable/disable)
-        buf[2+1 + pin*4] = st  # GPx output value
-        buf[2+2 + pin*4] = 0xFF  # Alter GPx pin direction (enable/disable)
-        buf[2+3 + pin*4] = 0x00  # Set GPx as output
+        changed = False
+        for pin in range(4):
+            st = values[pin]
+            if st is None:
+                continue
+            st = 1 if st else 0
+            if force or self.gpOutputShadow[pin] != st:
+                buf[2+0 + pin*4] = 0xFF  # Alter GPx output (enable/disable)
+                buf[2+1 + pin*4] = st  # GPx output value
+                changed = True
+            if force or self.gpDirectionShadow[pin] != 0:
+                buf[2+2 + pin*4] = 0xFF  # Alter GPx pin direction (enable/disable)
+                buf[2+3 + pin*4] = 0x00  # Set GPx as output
+                changed = True
+        if not changed:
+            return
 
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        assert info[0] == SET_GPIO_OUTPUT_VALUES
-        assert info[2+0 + pin] != 0xEE
-        assert info[2+1 + pin] != 0xEE
-        assert info[2+2 + pin] != 0xEE
-        assert info[2+3 + pin] != 0xEE
+        info = self.transfer(buf)
+        notGpio = []
+        for pin in range(4):
+            if buf[2+0 + pin*4] == 0 and buf[2+2 + pin*4] == 0:
+                continue
+            if 0xEE in info[2 + pin*4:2+4 + pin*4]:  # GPx is not set for GPIO operation
+                self.gpOutputShadow[pin] = None
+                self.gpDirectionShadow[pin] = None
+                notGpio.append(pin)
+                continue
+            self.gpOutputShadow[pin] = 1 if values[pin] else 0
+            self.gpDirectionShadow[pin] = 0
+        # The other pins were written by the chip, their shadows are updated before raising
+        if notGpio:
+            raise GpioError("%s not set for GPIO operation" % ', '.join('GP%u' % pin for pin in notGpio))
         return
 
     def readGP(self):
         # buf[0] = WRITE_GP_SETTINGS
         # Writing 0 means nothing changes
-        pinSt = [0]*4
-        buf = [0]*64
-        buf[0] = GET_GPIO_VALUES
+        return self.decodeGP(self.transfer(GET_GPIO_VALUES_COMMAND))
 
-        self.usbDevice.write(OUTPUT_ENDPOINT, buf)
-        info = self.usbDevice.read(INPUT_ENDPOINT, HID_PKT_SIZE)
-        assert info[0] == GET_GPIO_VALUES
-        assert info[1] == 0x00  # Command completed successfully
-        pinSt[0] = info[2 + 2*0]
-        pinSt[1] = info[2 + 2*1]
-        pinSt[2] = info[2 + 2*2]
-        pinSt[3] = info[2 + 2*3]
+    def decodeGP(self, info):
+        # Decode GET_GPIO_VALUES reply
+        if info[0] != GET_GPIO_VALUES:
+            raise UnexpectedReplyError('Reply 0x%02x is not a GPIO values reply' % info[0])
+        self.checkStatus(info, 'Get GPIO values')
+        pinSt = [info[2 + 2*0], info[2 + 2*1], info[2 + 2*2], info[2 + 2*3]]
+        for pin in range(4):
+            direction = info[3 + 2*pin]
+            if direction == 0xEE:
+                self.gpOutputShadow[pin] = None
+                self.gpDirectionShadow[pin] = None
+            else:
+                self.gpDirectionShadow[pin] = direction
         return pinSt
 
-    def lsUSB(self):
-        dev = usb.core.find(find_all=True)
-        # print("Number of devices: " + str(dev.__sizeof__()))
-        for device in dev:
-            print('\033[92m ~=== ' + str(self.getProduct(device)) + ' ===~\033[0m')
-            print('  \033[95m' + str(self.getManufacturer(device)) + '\033[0m')
-            print('  productID=' + hex(device.idProduct) + ' vendorID=' + hex(device.idVendor))
-            try:
-                print(device.get_active_configuration())
-            except:
-                print("Access denied")
+    def lsUSB(self, **filters):
+        # Print attached USB devices, filters as in usbIndex.find() (idVendor, idProduct, portPath, serial, ...)
+        for record in usbIndex.defaultIndex().find(**filters):
+            print('\033[92m ~=== ' + record.product + ' ===~\033[0m')
+            print('  \033[95m' + record.manufacturer + '\033[0m')
+            print('  productID=' + hex(record.idProduct) + ' vendorID=' + hex(record.idVendor) +
+                  ' bus=' + str(record.bus) + ' port=' + str(record.portPath))
+            if record.serial:
+                print('  serial=' + record.serial)
 
     def prettyPrint_GpSettings(self, gpSettings):
         print("GP0")
@@ -424,7 +1171,7 @@ if __name__ == '__main__':
 
     #start using the device with pre-determined endpoint numbers
     status = mcp2221a.getStatus()
-    print(mcp2221a.getProduct() + ' found')
+    print(getProduct(mcp2221a.usbDevice) + ' found')
     for attr in status:
         print('\t %s => %s' % (attr, status[attr]))
     if input("Everything looks good. Write manufacturer/product strings? (y/N): ").lower() == 'y':
@@ -0,0 +1,66 @@
+# Continuous ADC acquisition
+# ADC values come with every status report, so the sampler polls the status command back-to-back
+# (or with a fixed period) and stores timestamped values of the enabled channels in a ring buffer.
+# With decimation > 1 every stored sample is the average of that many polls.
+# While running the sampler owns the device, do not use the mcp2221a object from other threads.
+#
+# Usage:
+#     mcp2221a.configureAdc((1, 3), vref='2.048')
+#     adc = adcSampler.adcSampler(mcp2221a, channels=(1, 3), useNumpy=True)
+#     adc.start(); time.sleep(1); adc.stop()
+#     times, values = adc.samples.snapshot()
+import MCP2221A
+import ringBuffer
+import sampler
+
+class adcSampler(sampler.pollingSampler):
+
+    def __init__(self, mcp2221a, channels=(1, 2, 3), size=100000, period=0, decimation=1, useNumpy=False):
+        # channels   - ADC channels (1-3) stored, configure them first with mcp2221a.configureAdc()
+        # size       - number of samples kept in the ring buffer (memory is allocated once)
+        # period     - seconds between polls, 0 polls as fast as USB allows
+        # decimation - polls averaged into one stored sample
+        sampler.pollingSampler.__init__(self, mcp2221a, MCP2221A.STATUS_COMMAND, period)
+        for channel in channels:
+            if channel not in (1, 2, 3):
+                raise ValueError("ADC channels are 1-3")
+        self.channels = tuple(channels)
+        self.offsets = tuple(48 + 2*channel for channel in self.channels)  # Low byte of channel in status reply
+        self.decimation = max(1, decimation)
+        # Raw values are 10 bit integers, averages are floats
+        self.samples = ringBuffer.ringBuffer(size, len(self.channels), 'H' if self.decimation == 1 else 'f', useNumpy)
+        self.sums = [0]*len(self.channels)
+        self.accumulated = 0
+
+    def process(self, t, info):
+        values = [info[i] | (info[i + 1] << 8) for i in self.offsets]
+        if self.decimation == 1:
+            self.samples.appendRow(t, values)
+            return
+        sums = self.sums
+        for i in range(len(values)):
+            sums[i] += values[i]
+        self.accumulated += 1
+        if self.accumulated == self.decimation:
+            self.samples.appendRow(t, [x / self.decimation for x in sums])
+            self.sums = [0]*len(self.channels)
+            self.accumulated = 0
+
+    def channelSamples(self, channel):
+        # (timestamps, values) of one channel from the ring buffer, oldest first
+        times, data = self.samples.snapshot()
+        i = self.channels.index(channel)
+        if self.samples.useNumpy:
+            return times, data[:, i]
+        return times, data[i::len(self.channels)]
+
+    def stats(self):
+        output = sampler.pollingSampler.stats(self)
+        elapsed = output['elapsed']
+        output.update({
+            'samples': self.samples.count,
+            'sampleRate': self.samples.count / elapsed if elapsed > 0 else 0,
+            'overwritten': self.samples.overwritten(),
+            'bufferBytes': self.samples.nbytes(),
+        })
+        return output
@@ -0,0 +1,208 @@
+# asyncio API for MCP2221A
+# All commands go into one queue served by a single I/O worker thread, so any number of coroutines can
+# share the HID endpoint pair. Single report commands (readGP(), transfer()) are pipelined: up to
+# pipelineDepth reports are written before the oldest reply is read. Everything else runs as a
+# blocking mcp2221a call on the worker, after all pipelined replies were collected.
+#
+# Usage:
+#     async with asyncMCP2221A.asyncMcp2221a() as mcp2221a:
+#         pinSt = await mcp2221a.readGP(timeout=0.1)
+import MCP2221A
+import asyncio
+import collections
+import functools
+import queue
+import threading
+
+class request(object):
+    __slots__ = ('packet', 'decode', 'func', 'future', 'loop', 'cancelled', 'retries')
+
+    def __init__(self, packet, decode, func, future, loop):
+        self.packet = packet  # Report for pipelined requests
+        self.decode = decode  # decode(reply) -> result, reply is only valid during the call
+        self.func = func      # func() -> result for blocking calls
+        self.future = future
+        self.loop = loop
+        self.cancelled = threading.Event()
+        self.retries = 0  # Times the packet was sent again after a reply timeout
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        if future.cancelled():
+            self.cancelled.set()
+
+    def setResult(self, result):
+        self.loop.call_soon_threadsafe(self.deliver, result, None)
+
+    def setException(self, exception):
+        self.loop.call_soon_threadsafe(self.deliver, None, exception)
+
+    def deliver(self, result, exception):
+        if self.future.done():  # Cancelled/timed out meanwhile
+            return
+        if exception is not None:
+            self.future.set_exception(exception)
+        else:
+            self.future.set_result(result)
+
+STOP = object()
+
+class asyncMcp2221a(object):
+
+    def __init__(self, mcp2221a=None, transport=None, pipelineDepth=2):
+        # mcp2221a      - existing mcp2221a object (the worker becomes its only user)
+        # transport     - used to create mcp2221a if it is not given (None - first MCP2221A on USB)
+        # pipelineDepth - max. number of reports written before their replies are read (1 - no pipelining)
+        if mcp2221a is None:
+            mcp2221a = MCP2221A.mcp2221a(transport)
+        self.device = mcp2221a
+        self.pipelineDepth = max(1, pipelineDepth)
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self.serve, daemon=True)
+        self.worker.start()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def close(self):
+        # Finish queued requests and stop the worker
+        if self.worker.is_alive():
+            self.queue.put(STOP)
+            self.worker.join()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    # I/O worker
+
+    def serve(self):
+        device = self.device
+        transport = device.transport
+        inflight = collections.deque()
+
+        def completeOldest():
+            # Reply with the device timeout, stale replies are discarded (ReplyTimeoutError/UnexpectedReplyError
+            # as in transfer()). After a timeout RETRYABLE_COMMANDS are sent again, behind the reports in flight.
+            item = inflight.popleft()
+            cmd = item.packet[0]
+            try:
+                reply = device.readReply(cmd, device.timeout)
+            except MCP2221A.ReplyTimeoutError as e:
+                if cmd in MCP2221A.RETRYABLE_COMMANDS and item.retries < device.retries and \
+                        not item.cancelled.is_set():
+                    item.retries += 1
+                    try:
+                        transport.write(item.packet)
+                    except Exception as writeError:
+                        item.setException(writeError)
+                        return
+                    inflight.append(item)
+                    return
+                item.setException(e)
+                return
+            except Exception as e:
+                item.setException(e)
+                return
+            try:
+                if not item.cancelled.is_set():
+                    item.setResult(item.decode(reply))
+            except Exception as e:
+                item.setException(e)
+
+        while True:
+            if inflight:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    # Nothing new to send, collect a reply
+                    completeOldest()
+                    continue
+            else:
+                item = self.queue.get()
+
+            if item is STOP:
+                while inflight:
+                    completeOldest()
+                return
+            if item.cancelled.is_set():
+                continue
+
+            if item.func is None:
+                if len(inflight) >= self.pipelineDepth:
+                    completeOldest()
+                try:
+                    transport.write(item.packet)
+                except Exception as e:
+                    item.setException(e)
+                    continue
+                inflight.append(item)
+            else:
+                # Blocking call might do several transactions, replies must not be mixed
+                while inflight:
+                    completeOldest()
+                try:
+                    item.setResult(item.func())
+                except Exception as e:
+                    item.setException(e)
+
+    # Request submission
+
+    async def submit(self, packet=None, decode=None, func=None, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queue.put(request(packet, decode, func, future, loop))
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    async def call(self, func, *args, timeout=None):
+        # Run any blocking function on the worker, func(*args)
+        return await self.submit(func=functools.partial(func, *args), timeout=timeout)
+
+    # Pipelined commands
+
+    async def transfer(self, buf, timeout=None):
+        # Send one report, returns reply as bytes
+        packet = bytes(buf) + bytes(MCP2221A.HID_PKT_SIZE - len(buf))
+        return await self.submit(packet, lambda reply: reply.tobytes(), timeout=timeout)
+
+    async def readGP(self, timeout=None):
+        return await self.submit(MCP2221A.GET_GPIO_VALUES_COMMAND, self.device.decodeGP, timeout=timeout)
+
+    # Blocking commands, same names as mcp2221a
+
+    async def writeGP(self, pin, st, timeout=None):
+        return await self.call(self.device.writeGP, pin, st, timeout=timeout)
+
+    async def writeGPs(self, values, force=False, timeout=None):
+        return await self.call(self.device.writeGPs, values, force, timeout=timeout)
+
+    async def writeGPMask(self, mask, values, timeout=None):
+        return await self.call(self.device.writeGPMask, mask, values, timeout=timeout)
+
+    async def getStatus(self, timeout=None):
+        return await self.call(self.device.getStatus, timeout=timeout)
+
+    async def getSnapshot(self, refresh=False, timeout=None):
+        return await self.call(self.device.getSnapshot, refresh, timeout=timeout)
+
+    async def readFlashGpSettings(self, timeout=None):
+        return await self.call(self.device.readFlashGpSettings, timeout=timeout)
+
+    async def writeFlashGpSettings(self, gpSettings, timeout=None):
+        return await self.call(self.device.writeFlashGpSettings, gpSettings, timeout=timeout)
+
+    async def writeDescriptor(self, name, descriptor, timeout=None):
+        return await self.call(self.device.writeDescriptor, name, descriptor, timeout=timeout)
+
+    async def setAllInput(self, timeout=None):
+        return await self.call(self.device.setAllInput, timeout=timeout)
+
+    async def setAllOutput(self, timeout=None):
+        return await self.call(self.device.setAllOutput, timeout=timeout)
+
+    async def resetChip(self, timeout=None):
+        return await self.call(self.device.resetChip, timeout=timeout)
@@ -0,0 +1,140 @@
+# Benchmark of the mcp2221a API against the software MCP2221A (no hardware needed)
+# Reports HID transactions per operation and operations per second
+# (and bytes per second for I2C transfers, emulated EEPROM at I2C_EEPROM_ADDRESS, 400 kHz)
+# Run: python3 benchmark.py [--latency 0.001] [--iterations 200] [--json results.json]
+# Regression check: python3 benchmark.py --latency 0.001 --baseline .github/benchmark-baseline.json
+# fails (exit code 1) when an operation needs more transactions than in the baseline (I2C busy polls vary with
+# timing, --max-extra-transactions). Ops/sec depend on the host, they are only checked with --max-slowdown
+# (baseline measured on the same host) and never for operations without transactions (pure CPU time).
+import MCP2221A
+import emulator
+import argparse
+import json
+import sys
+import time
+
+I2C_EEPROM_ADDRESS = 0x50
+I2C_SIZES = [1, 16, 60, 256, 4096]
+
+def benchWriteFlashGpSettings(mcp2221a):
+    gpSettings = mcp2221a.readFlashGpSettings()
+    gpSettings.B.GP0.B.outputVal ^= 1
+    mcp2221a.writeFlashGpSettings(gpSettings)
+
+def benchWriteGP(mcp2221a):
+    mcp2221a.benchPinState ^= 1
+    mcp2221a.writeGP(0, mcp2221a.benchPinState)
+
+BENCHMARKS = [
+    ('getStatus', lambda mcp2221a: mcp2221a.getStatus()),
+    ('getSnapshot(refresh)', lambda mcp2221a: mcp2221a.getSnapshot(refresh=True)),
+    ('readGP', lambda mcp2221a: mcp2221a.readGP()),
+    ('writeGP', benchWriteGP),
+    ('readFlash(GP)', lambda mcp2221a: mcp2221a.readFlash(MCP2221A.READ_GP_SETTINGS, cached=False)),
+    ('readFlashGpSettings(cached)', lambda mcp2221a: mcp2221a.readFlashGpSettings()),
+    ('writeFlashGpSettings', benchWriteFlashGpSettings),
+    ('writeDescriptor', lambda mcp2221a: mcp2221a.writeDescriptor("Benchmark", "Product")),
+]
+
+def i2cWriteBenchmark(size):
+    data = b'\x00\x00' + bytes(size)
+    return lambda mcp2221a: mcp2221a.i2cWrite(I2C_EEPROM_ADDRESS, data)
+
+def i2cReadBenchmark(size):
+    return lambda mcp2221a: mcp2221a.i2cWriteRead(I2C_EEPROM_ADDRESS, b'\x00\x00', size)
+
+# I2C benchmarks: (name, operation, payload bytes per operation)
+I2C_BENCHMARKS = [('i2cWrite(%u)' % size, i2cWriteBenchmark(size), size) for size in I2C_SIZES] + \
+                 [('i2cWriteRead(%u)' % size, i2cReadBenchmark(size), size) for size in I2C_SIZES]
+
+def runBenchmark(name, operation, iterations, latency, payload=0):
+    chip = emulator.mcp2221aEmulator(latency=latency)
+    chip.i2cTargets[I2C_EEPROM_ADDRESS] = emulator.i2cEeprom()
+    mcp2221a = MCP2221A.mcp2221a(chip)
+    mcp2221a.benchPinState = 0
+    mcp2221a.setAllOutput()
+    mcp2221a.i2cSetSpeed(400000)
+
+    operation(mcp2221a)  # Warm up
+    transactionsStart = chip.transactions
+    timeStart = time.perf_counter()
+    for i in range(iterations):
+        operation(mcp2221a)
+    elapsed = time.perf_counter() - timeStart
+
+    result = {
+        'name': name,
+        'iterations': iterations,
+        'transactionsPerOp': (chip.transactions - transactionsStart) / iterations,
+        'opsPerSec': iterations / elapsed,
+        'usPerOp': elapsed / iterations * 1e6,
+    }
+    if payload:
+        result['bytesPerSec'] = payload * iterations / elapsed
+    return result
+
+def compare(results, baseline, maxSlowdown, maxExtraTransactions):
+    # Regressions against baseline results (same --latency), list of messages
+    regressions = []
+    previous = dict((result['name'], result) for result in baseline['results'])
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        if result['transactionsPerOp'] > old['transactionsPerOp'] * (1 + maxExtraTransactions) + 1e-9:
+            regressions.append('%s: %.2f transactions/op, baseline %.2f' % (
+                result['name'], result['transactionsPerOp'], old['transactionsPerOp']))
+        if maxSlowdown is not None and old['transactionsPerOp'] > 0 and \
+                result['opsPerSec'] < old['opsPerSec'] * (1 - maxSlowdown):
+            regressions.append('%s: %.1f ops/sec, baseline %.1f' % (result['name'], result['opsPerSec'],
+                                                                   old['opsPerSec']))
+    return regressions
+
+def runAll(iterations, latency, names=None):
+    results = []
+    for name, operation in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results.append(runBenchmark(name, operation, iterations, latency))
+    for name, operation, payload in I2C_BENCHMARKS:
+        if names and name not in names:
+            continue
+        # Large transfers take long on the emulated bus, keep total transferred data bounded
+        results.append(runBenchmark(name, operation, max(1, min(iterations, 65536 // payload)), latency, payload))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MCP2221A library benchmark (emulated chip)')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0, help='Emulated latency per transaction [s]')
+    parser.add_argument('--only', nargs='*', help='Run only the listed benchmarks')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results of this JSON file, exit code 1 on regression')
+    parser.add_argument('--max-slowdown', type=float,
+                        help='Allowed ops/sec drop against the baseline (0.25 - 25%%), not checked by default')
+    parser.add_argument('--max-extra-transactions', type=float, default=0.1,
+                        help='Allowed transactions/op increase against the baseline (0.1 - 10%%)')
+    args = parser.parse_args()
+
+    results = runAll(args.iterations, args.latency, args.only)
+
+    print("%-28s %14s %12s %12s %12s" % ('Operation', 'Transactions', 'Ops/sec', 'us/op', 'Bytes/sec'))
+    for result in results:
+        print("%-28s %14.2f %12.1f %12.1f %12s" % (result['name'], result['transactionsPerOp'],
+                                                  result['opsPerSec'], result['usPerOp'],
+                                                  '%.0f' % result['bytesPerSec'] if 'bytesPerSec' in result else ''))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'latency': args.latency, 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['latency'] != args.latency:
+            parser.error('Baseline was measured with --latency %s' % baseline['latency'])
+        regressions = compare(results, baseline, args.max_slowdown, args.max_extra_transactions)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,274 @@
+# Binary capture of HID transactions and deterministic replay
+# mcp2221a.startCapture(path) wraps the device transport in captureTransport, which appends every
+# request/reply pair to an append-only file of fixed-size records:
+#     header: magic (8 bytes), version (uint16), record size (uint16), 4 bytes reserved
+#     record: request write time, reply read time (float64 seconds, monotonic clock, -1 if there is no reply),
+#             request (64 bytes), reply (64 bytes)
+# Replies are matched to pending requests by command byte: requests skipped by a reply (their replies were lost)
+# are recorded without reply, a reply no request is waiting for (late reply of a request that already timed out)
+# is recorded as a reply-only record (write time -1, request all zeros), replayTransport returns it as it came.
+# captureFile memory-maps a capture for reading, replayTransport feeds the recorded replies back to mcp2221a.
+#
+# Usage:
+#     mcp2221a.startCapture('line3.cap')
+#     ...
+#     mcp2221a = MCP2221A.mcp2221a(capture.replayTransport('line3.cap'))
+import metrics
+import collections
+import mmap
+import os
+import struct
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'MCP2221C'
+VERSION = 1
+PKT_SIZE = 64
+CMD_RESET = 0x70  # Reset has no reply
+HEADER = struct.Struct('<8sHH4x')
+RECORD = struct.Struct('<dd%us%us' % (PKT_SIZE, PKT_SIZE))
+
+class captureTransport(object):
+    # Wraps a transport and appends every transaction to a capture file
+
+    def __init__(self, transport, path, flushEvery=1):
+        # flushEvery - records buffered before they are written to the file (1 - every record, survives crashes)
+        self.transport = transport
+        self.path = path
+        self.flushEvery = flushEvery
+        self.unflushed = 0
+        self.pending = collections.deque()  # (request, write time) waiting for reply
+        self.records = 0
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.file.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def append(self, request, tWrite, reply, tRead):
+        self.file.write(RECORD.pack(tWrite, tRead, request, reply))
+        self.records += 1
+        self.unflushed += 1
+        if self.unflushed >= self.flushEvery:
+            self.file.flush()
+            self.unflushed = 0
+
+    def write(self, buf):
+        request = bytes(buf).ljust(PKT_SIZE, b'\x00')
+        tWrite = time.perf_counter()
+        self.transport.write(buf)
+        if request[0] == CMD_RESET:
+            self.append(request, tWrite, b'', -1.0)
+        else:
+            self.pending.append((request, tWrite))
+
+    def completed(self, reply):
+        # reply None - the read timed out, the oldest request is recorded without reply (replays as a timeout)
+        if reply is None:
+            if self.pending:
+                request, tWrite = self.pending.popleft()
+                self.append(request, tWrite, b'', -1.0)
+            return
+        tRead = time.perf_counter()
+        for request, tWrite in self.pending:
+            if request[0] == reply[0]:
+                break
+        else:
+            self.append(bytes(PKT_SIZE), -1.0, bytes(reply), tRead)
+            return
+        while True:
+            request, tWrite = self.pending.popleft()
+            if request[0] == reply[0]:
+                self.append(request, tWrite, bytes(reply), tRead)
+                return
+            self.append(request, tWrite, b'', -1.0)
+
+    def read(self, timeout=None):
+        try:
+            reply = self.transport.read(timeout)
+        except Exception as e:
+            if metrics.isTimeout(e):
+                self.completed(None)
+            raise
+        self.completed(reply)
+        return reply
+
+    def readInto(self, buf, timeout=None):
+        try:
+            n = self.transport.readInto(buf, timeout)
+        except Exception as e:
+            if metrics.isTimeout(e):
+                self.completed(None)
+            raise
+        self.completed(buf)
+        return n
+
+    def tryReadInto(self, buf, timeout=None):
+        # No reply yet, the request stays pending
+        n = self.transport.tryReadInto(buf, timeout)
+        self.completed(buf)
+        return n
+
+    def reconnect(self):
+        self.pending.clear()
+        return self.transport.reconnect()
+
+    def close(self):
+        self.file.close()
+
+class captureFile(object):
+    # Read-only, memory-mapped capture file
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError('Not a capture file: ' + path)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, recordSize = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or recordSize != RECORD.size:
+            raise ValueError('Not a capture file (or unsupported version): ' + path)
+        # An incomplete last record (writer killed while writing) is ignored
+        self.count = (size - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        # (write time, read time, request, reply), read time is -1 for requests without reply
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('Capture record out of range')
+        return RECORD.unpack_from(self.map, HEADER.size + i*RECORD.size)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def asNumpy(self):
+        # Structured NumPy array view (no copy): tWrite, tRead, request (64 x uint8), reply (64 x uint8)
+        if numpy is None:
+            raise ValueError('NumPy is not installed')
+        dtype = numpy.dtype([('tWrite', '<f8'), ('tRead', '<f8'), ('request', 'u1', (PKT_SIZE,)),
+                             ('reply', 'u1', (PKT_SIZE,))])
+        return numpy.frombuffer(self.map, dtype=dtype, count=self.count, offset=HEADER.size)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class replayTransport(object):
+    # Transport answering with replies from a capture file, in recorded order
+    usbDevice = None
+
+    def __init__(self, path, realtime=False, strict=True):
+        # realtime - delay every reply by its recorded latency (False - reply immediately)
+        # strict   - raise IOError when the library sends a different request than recorded
+        self.capture = captureFile(path)
+        self.realtime = realtime
+        self.strict = strict
+        self.index = 0
+        self.replies = collections.deque()  # (ready time, reply)
+
+    def queueReplyOnly(self):
+        # Reply-only records (late replies) are readable right after the request recorded before them
+        while self.index < len(self.capture) and self.capture[self.index][0] < 0:
+            self.replies.append((time.perf_counter(), self.capture[self.index][3]))
+            self.index += 1
+
+    def write(self, buf):
+        self.queueReplyOnly()
+        if self.index >= len(self.capture):
+            raise EOFError('End of capture')
+        tWrite, tRead, request, reply = self.capture[self.index]
+        self.index += 1
+        if self.strict and bytes(buf).ljust(PKT_SIZE, b'\x00') != request:
+            raise IOError('Request 0x%02x does not match capture record %u (0x%02x)' % (buf[0], self.index - 1,
+                                                                                       request[0]))
+        if tRead >= 0:
+            ready = time.perf_counter() + (tRead - tWrite if self.realtime else 0)
+            self.replies.append((ready, reply))
+        self.queueReplyOnly()
+
+    def read(self, timeout=None):
+        if not self.replies:
+            raise TimeoutError('Replay: read without pending reply')
+        ready, reply = self.replies.popleft()
+        delay = ready - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return reply
+
+    def readInto(self, buf, timeout=None):
+        reply = self.read(timeout)
+        memoryview(buf)[:len(reply)] = reply
+        return len(reply)
+
+    def tryReadInto(self, buf, timeout=None):
+        return self.readInto(buf, timeout)
+
+    def reconnect(self):
+        pass
+
+    def remaining(self):
+        return len(self.capture) - self.index
+
+def checkReplay(path):
+    # Capture a session with lost and late replies on the emulated chip, replay it and compare the results
+    # Returns list of (operation, live result, replayed result) that differ
+    import MCP2221A
+    import emulator
+
+    def session(mcp2221a, chip=None):
+        mcp2221a.timeout = 20
+        results = [('readGP', mcp2221a.readGP())]
+        if chip is not None:
+            chip.injectFaults(drop=1)
+        results.append(('readGP (lost reply)', mcp2221a.readGP()))
+        if chip is not None:
+            chip.injectFaults(delays=[0.03])
+        results.append(('readGP (late reply)', mcp2221a.readGP()))
+        results.append(('getStatus', mcp2221a.getStatus()))
+        mcp2221a.post(MCP2221A.GET_GPIO_VALUES_COMMAND)
+        while mcp2221a.tryRead(MCP2221A.GET_GPIO_VALUES) is None:
+            pass
+        results.append(('readFlash', mcp2221a.readFlash(MCP2221A.READ_GP_SETTINGS, cached=False)))
+        return results
+
+    if os.path.exists(path):
+        os.remove(path)
+    chip = emulator.mcp2221aEmulator()
+    mcp2221a = MCP2221A.mcp2221a(chip)
+    mcp2221a.startCapture(path)
+    live = session(mcp2221a, chip)
+    mcp2221a.stopCapture()
+    replayed = session(MCP2221A.mcp2221a(replayTransport(path)))
+    return [(name, a, b) for (name, a), (other, b) in zip(live, replayed) if a != b]
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description='MCP2221A capture files')
+    parser.add_argument('--check', action='store_true',
+                        help='capture and replay a session with lost and late replies on the emulated chip')
+    parser.add_argument('capture', nargs='?', help='print the records of this capture file')
+    args = parser.parse_args()
+
+    if args.check:
+        path = os.path.join(tempfile.mkdtemp(), 'check.cap')
+        differences = checkReplay(path)
+        for name, live, replayed in differences:
+            print('%s: live %r, replayed %r' % (name, live, replayed))
+        print('Replay differs' if differences else 'Replay matches')
+        raise SystemExit(1 if differences else 0)
+    if args.capture:
+        for tWrite, tRead, request, reply in captureFile(args.capture):
+            print('%14.6f %14.6f  %s  %s' % (tWrite, tRead, '--' if tWrite < 0 else '%02x' % request[0],
+                                            '--' if tRead < 0 else '%02x' % reply[0]))
@@ -0,0 +1,58 @@
+# DAC waveform playback
+# Waveforms are converted to 5 bit DAC codes and precomputed into SET_SRAM_SETTINGS reports once,
+# playback (reportPlayer) only sends the ready reports against a monotonic clock.
+#
+# Usage:
+#     mcp2221a.configureDac((2,), vref='VDD')
+#     wave = dacWaveform.sine(32)
+#     player = wave.play(mcp2221a, rate=500, loops=0)  # 500 updates/s until player.stop()
+#     ...
+#     player.stop(); print(player.stats())
+import MCP2221A
+import reportPlayer
+import math
+
+class dacWaveform(object):
+
+    def __init__(self, codes):
+        # codes - DAC values (0-31), one per update
+        self.codes = [int(code) for code in codes]
+        self.reports = [MCP2221A.dacPacket(code) for code in self.codes]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def player(self, mcp2221a, rate, loops=1, spin=0.0005):
+        # rate - DAC updates per second (0 - as fast as possible)
+        return reportPlayer.reportPlayer(mcp2221a, self.reports, 1.0/rate if rate else 0, loops=loops, spin=spin)
+
+    def play(self, mcp2221a, rate, loops=1, spin=0.0005):
+        # Start playback in background thread, returns the player (stop(), stats())
+        player = self.player(mcp2221a, rate, loops, spin)
+        player.start()
+        return player
+
+def fromSamples(samples, low=0.0, high=1.0):
+    # Arbitrary waveform, samples between low and high are scaled to the full DAC range
+    if high <= low:
+        raise ValueError("high must be greater than low")
+    scale = MCP2221A.DAC_MAX / float(high - low)
+    return dacWaveform([min(MCP2221A.DAC_MAX, max(0, int(round((x - low)*scale)))) for x in samples])
+
+def sine(length=32, amplitude=1.0, offset=0.5):
+    # One period of a sine, amplitude/offset relative to full scale (output = offset + amplitude/2 * sin)
+    return fromSamples([offset + amplitude/2*math.sin(2*math.pi*i/length) for i in range(length)])
+
+def ramp(length=32, up=True):
+    # One period of a sawtooth from 0 to full scale (or back with up=False)
+    if length < 2:
+        raise ValueError("Ramp needs at least 2 samples")
+    samples = [i/float(length - 1) for i in range(length)]
+    return fromSamples(samples if up else samples[::-1])
+
+def triangle(length=64):
+    if length < 2:
+        raise ValueError("Triangle needs at least 2 samples")
+    half = length // 2
+    samples = [i/float(half) for i in range(half)] + [1 - i/float(length - half) for i in range(length - half)]
+    return fromSamples(samples)
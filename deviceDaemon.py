@@ -0,0 +1,246 @@
+# Long-lived daemon sharing MCP2221A chips between processes over a Unix domain socket
+# The daemon claims the chips once (pyusb import, enumeration and kernel driver detach are paid only at its start).
+# Clients use socketTransport, so the usual mcp2221a object works unchanged on top of it:
+#     mcp2221a = deviceDaemon.connect(serial='01234567')
+#     mcp2221a.writeGP(0, 1)
+#
+# Protocol: every frame is a 4 byte header (op or status, flags, payload length (uint16)) followed by the payload.
+# OP_TRANSFER carries one 64 byte report and is answered with the 64 byte reply, so a transaction costs one small
+# write and read on each side. A chip reply timeout is answered with STATUS_TIMEOUT, so clients see a timeout
+# (mcp2221a retries and ReplyTimeoutError work as on USB). Transactions of different clients are serialized per
+# chip (command-level arbitration); lock()/unlock() (or "with transport.locked():") give one client the chip for a
+# whole sequence (multi-report I2C transfers, read-modify-write of settings).
+#
+# Run: python3 deviceDaemon.py [--socket /tmp/mcp2221a.sock] [--emulate 2]
+import MCP2221A
+import deviceManager
+import metrics
+import argparse
+import array
+import contextlib
+import os
+import select
+import socket
+import socketserver
+import struct
+
+DEFAULT_SOCKET = os.environ.get('MCP2221A_SOCKET', '/tmp/mcp2221a.sock')
+
+HEADER = struct.Struct('<BBH')
+MAX_PAYLOAD = 256
+
+OP_OPEN = 0x01      # Payload: serial (utf-8, empty - first chip), reply: serial of the opened chip
+OP_LIST = 0x02      # Reply: newline separated serials
+OP_TRANSFER = 0x03  # Payload: 64 byte report, reply: 64 byte reply (empty after CMD_RESET, once the chip is back)
+OP_LOCK = 0x04      # Exclusive use of the opened chip until OP_UNLOCK or disconnect
+OP_UNLOCK = 0x05
+
+STATUS_OK = 0x00
+STATUS_ERROR = 0x01  # Payload: error message
+STATUS_TIMEOUT = 0x02  # No reply from the chip, payload: error message (client raises TimeoutError)
+
+def recvInto(sock, view):
+    # Receive exactly len(view) bytes into memoryview view, False if the connection was closed before the first byte
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return False
+            raise ConnectionError('Connection closed in the middle of a frame')
+        received += n
+    return True
+
+def sendFrame(sock, op, payload=b''):
+    sock.sendmsg([HEADER.pack(op, 0, len(payload)), payload])
+
+class connectionHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        sock = self.request
+        header = bytearray(HEADER.size)
+        headerView = memoryview(header)
+        payload = bytearray(MAX_PAYLOAD)
+        payloadView = memoryview(payload)
+        reply = array.array('B', MCP2221A.EMPTY_PACKET)
+        entry = None
+        locks = 0  # Times this connection acquired entry.lock with OP_LOCK
+        try:
+            while recvInto(sock, headerView):
+                op, flags, length = HEADER.unpack(header)
+                if length > MAX_PAYLOAD:
+                    raise ConnectionError('Frame too long')
+                request = payloadView[:length]
+                recvInto(sock, request)
+                try:
+                    if op == OP_TRANSFER:
+                        if entry is None:
+                            raise IOError('No chip opened')
+                        with entry.lock:
+                            transport = entry.device.transport
+                            transport.write(request)
+                            if request[0] == MCP2221A.CMD_RESET:
+                                transport.reconnect()
+                                sendFrame(sock, STATUS_OK)
+                                continue
+                            transport.readInto(reply)
+                        sendFrame(sock, STATUS_OK, reply)
+                    elif op == OP_OPEN:
+                        while locks:
+                            entry.lock.release()
+                            locks -= 1
+                        serial = bytes(request).decode('utf-8')
+                        entry = self.server.manager.find(serial) if serial else self.server.manager.entries[0]
+                        sendFrame(sock, STATUS_OK, entry.factorySerial.encode('utf-8'))
+                    elif op == OP_LIST:
+                        serials = sorted(self.server.manager.indexFactorySerial())
+                        sendFrame(sock, STATUS_OK, '\n'.join(serials).encode('utf-8'))
+                    elif op == OP_LOCK:
+                        if entry is None:
+                            raise IOError('No chip opened')
+                        entry.lock.acquire()
+                        locks += 1
+                        sendFrame(sock, STATUS_OK)
+                    elif op == OP_UNLOCK:
+                        if not locks:
+                            raise IOError('Chip is not locked')
+                        entry.lock.release()
+                        locks -= 1
+                        sendFrame(sock, STATUS_OK)
+                    else:
+                        raise IOError('Unknown operation 0x%02x' % op)
+                except (IOError, ValueError, IndexError, AssertionError) as e:
+                    status = STATUS_TIMEOUT if metrics.isTimeout(e) else STATUS_ERROR
+                    sendFrame(sock, status, str(e).encode('utf-8')[:MAX_PAYLOAD])
+        except ConnectionError:
+            pass
+        finally:
+            while locks:
+                entry.lock.release()
+                locks -= 1
+
+class deviceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # One thread per client connection, chips are shared through deviceManager entries (entry.lock per chip)
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_SOCKET, manager=None):
+        self.manager = manager if manager is not None else deviceManager.deviceManager()
+        if len(self.manager) == 0:
+            raise ValueError('No MCP2221A device found')
+        self.manager.indexFactorySerial()  # Claim every chip now, not on the first request
+        if os.path.exists(path):
+            os.unlink(path)  # Stale socket of a previous daemon
+        socketserver.UnixStreamServer.__init__(self, path, connectionHandler)
+        self.path = path
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.manager.close()
+
+class socketTransport(MCP2221A.transport):
+    # Client side transport, one connection per chip
+
+    def __init__(self, path=DEFAULT_SOCKET, serial=None):
+        # serial - chip factory serial number or USB serial number string, None - first chip of the daemon
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.header = bytearray(HEADER.size)
+        self.outstanding = 0  # OP_TRANSFER frames not answered yet
+        self.serial = self.request(OP_OPEN, (serial or '').encode('utf-8')).decode('utf-8')
+
+    def receive(self, buf=None):
+        # Reply payload into buf (returns its length) or as bytes
+        if not recvInto(self.sock, memoryview(self.header)):
+            raise ConnectionError('Daemon closed the connection')
+        status, flags, length = HEADER.unpack(self.header)
+        if status != STATUS_OK or buf is None:
+            data = bytearray(length)
+            recvInto(self.sock, memoryview(data))
+            if status == STATUS_TIMEOUT:
+                raise TimeoutError(data.decode('utf-8'))
+            if status != STATUS_OK:
+                raise IOError(data.decode('utf-8'))
+            return bytes(data)
+        recvInto(self.sock, memoryview(buf)[:length])
+        return length
+
+    def request(self, op, payload=b''):
+        sendFrame(self.sock, op, payload)
+        return self.receive()
+
+    def write(self, buf):
+        sendFrame(self.sock, OP_TRANSFER, buf)
+        self.outstanding += 1
+
+    def read(self, timeout=None):
+        reply = array.array('B', MCP2221A.EMPTY_PACKET)
+        self.readInto(reply, timeout)
+        return reply
+
+    def readInto(self, buf, timeout=None):
+        # timeout - ms, None - wait for the daemon (it waits for the chip with its own transport timeout)
+        # The daemon answers every OP_TRANSFER, a reply that comes after the timeout stays in the stream and is
+        # read as a late reply, like on USB
+        if not self.outstanding:
+            raise TimeoutError('No request waiting for a reply')
+        if timeout is not None and not select.select([self.sock], [], [], timeout / 1000.0)[0]:
+            raise TimeoutError('No reply from the daemon within %u ms' % timeout)
+        self.outstanding -= 1
+        return self.receive(buf)
+
+    def reconnect(self):
+        # Daemon answers CMD_RESET once the chip is back
+        self.outstanding -= 1
+        self.receive()
+
+    def lock(self):
+        self.request(OP_LOCK)
+
+    def unlock(self):
+        self.request(OP_UNLOCK)
+
+    @contextlib.contextmanager
+    def locked(self):
+        self.lock()
+        try:
+            yield self
+        finally:
+            self.unlock()
+
+    def listDevices(self):
+        # Factory serial numbers of all chips served by the daemon
+        data = self.request(OP_LIST).decode('utf-8')
+        return data.split('\n') if data else []
+
+    def close(self):
+        self.sock.close()
+
+def connect(path=DEFAULT_SOCKET, serial=None):
+    # mcp2221a object talking to the chip through the daemon, other clients can change the chip between its
+    # transactions, so GP writes are never skipped and flash is not cached
+    return MCP2221A.mcp2221a(socketTransport(path, serial), shared=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve MCP2221A chips over a Unix domain socket')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='socket path (default %(default)s)')
+    parser.add_argument('--emulate', type=int, default=0, help='serve this many emulated chips instead of USB')
+    args = parser.parse_args()
+
+    manager = None
+    if args.emulate:
+        import emulator
+        chips = [emulator.mcp2221aEmulator() for i in range(args.emulate)]
+        for i, chip in enumerate(chips):
+            chip.factorySerial = '%08u' % i
+        manager = deviceManager.deviceManager(transports=chips)
+
+    server = deviceServer(args.socket, manager)
+    print("Serving %u MCP2221A on %s" % (len(server.manager), args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,182 @@
+# Manager for many MCP2221A chips on one host
+# Chips are enumerated once and addressed by chip factory serial number or USB serial number descriptor
+# string. Devices are opened (kernel driver detached) only when first used. runAll() runs the same
+# operation on many chips in parallel on a thread pool.
+#
+# Usage:
+#     manager = deviceManager.deviceManager()
+#     manager.get('01234567').writeGP(0, 1)
+#     for result in manager.runAll(lambda mcp2221a: mcp2221a.getStatus()):
+#         print(result.serial, result.value)
+import MCP2221A
+import usbIndex
+import concurrent.futures
+import threading
+import time
+import usb.core
+import usb.util
+
+class deviceEntry(object):
+    # One chip, mcp2221a object is created on first use
+
+    def __init__(self, usbDevice=None, transport=None, record=None):
+        # record - usbIndex.usbRecord of the device (cached string descriptors)
+        self.usbDevice = usbDevice
+        self.record = record
+        self.transport = transport
+        self.lock = threading.RLock()  # Serializes operations on this chip
+        self.mcp2221a = None
+        self._usbSerial = None
+        self._factorySerial = None
+
+    @property
+    def device(self):
+        with self.lock:
+            if self.mcp2221a is None:
+                if self.transport is None:
+                    self.transport = MCP2221A.usbTransport(self.usbDevice)
+                self.mcp2221a = MCP2221A.mcp2221a(self.transport)
+            return self.mcp2221a
+
+    @property
+    def isOpen(self):
+        return self.mcp2221a is not None
+
+    @property
+    def usbSerial(self):
+        # USB Serial Number Descriptor String
+        if self._usbSerial is None:
+            if self.record is not None and not self.isOpen:
+                self._usbSerial = self.record.serial
+            elif self.usbDevice is not None and not self.isOpen:
+                # Read from the device descriptor, no need to claim the HID interface
+                try:
+                    self._usbSerial = usb.util.get_string(self.usbDevice, self.usbDevice.iSerialNumber) or ''
+                except (ValueError, usb.core.USBError):
+                    self._usbSerial = ''
+            else:
+                with self.lock:
+                    self._usbSerial = self.device.readUsbSerialNumberDescriptorString()
+        return self._usbSerial
+
+    @property
+    def factorySerial(self):
+        # Chip factory serial number, needs the device to be opened
+        if self._factorySerial is None:
+            with self.lock:
+                self._factorySerial = self.device.readChipFactorySerialNumber()
+        return self._factorySerial
+
+class deviceResult(object):
+    __slots__ = ('serial', 'value', 'error', 'elapsed')
+
+    def __init__(self, serial, value, error, elapsed):
+        self.serial = serial    # Chip factory serial number
+        self.value = value      # Return value of the operation
+        self.error = error      # Exception raised by the operation, None if it succeeded
+        self.elapsed = elapsed  # Seconds spent in the operation
+
+    def __repr__(self):
+        if self.error is not None:
+            return "deviceResult(%s, error=%r, elapsed=%.6f)" % (self.serial, self.error, self.elapsed)
+        return "deviceResult(%s, %r, elapsed=%.6f)" % (self.serial, self.value, self.elapsed)
+
+class deviceManager(object):
+
+    def __init__(self, idVendor=MCP2221A.USB_VENDOR_ID, idProduct=MCP2221A.USB_PRODUCT_ID, transports=None, maxWorkers=None):
+        # transports - manage these transports (for example emulated chips) instead of enumerating USB
+        # maxWorkers - thread pool size for runAll() (None - one thread per chip)
+        self.idVendor = idVendor
+        self.idProduct = idProduct
+        self.maxWorkers = maxWorkers
+        self.executor = None
+        self.entries = []
+        if transports is not None:
+            self.entries = [deviceEntry(transport=transport) for transport in transports]
+        else:
+            self.enumerate()
+        self.byUsbSerial = None
+        self.byFactorySerial = None
+
+    def enumerate(self):
+        self.entries = [deviceEntry(usbDevice=record.usbDevice, record=record) for record in
+                        usbIndex.defaultIndex().find(self.idVendor, self.idProduct)]
+        self.byUsbSerial = None
+        self.byFactorySerial = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def indexUsbSerial(self):
+        if self.byUsbSerial is None:
+            # Chips not providing serial number on enumeration have empty serial, they are not indexed
+            self.byUsbSerial = dict((entry.usbSerial, entry) for entry in self.entries if entry.usbSerial)
+        return self.byUsbSerial
+
+    def indexFactorySerial(self):
+        # Opens every chip (factory serial number can only be read through HID)
+        if self.byFactorySerial is None:
+            self.run(lambda entry: entry.factorySerial, self.entries)
+            byFactorySerial = dict()
+            for entry in self.entries:
+                if entry.factorySerial in byFactorySerial:
+                    raise ValueError('Several MCP2221A devices with factory serial ' + entry.factorySerial)
+                byFactorySerial[entry.factorySerial] = entry
+            self.byFactorySerial = byFactorySerial
+        return self.byFactorySerial
+
+    def find(self, serial):
+        # deviceEntry by chip factory serial number or USB serial number descriptor string
+        entry = self.indexUsbSerial().get(serial)
+        if entry is None:
+            entry = self.indexFactorySerial().get(serial)
+        if entry is None:
+            raise ValueError('No MCP2221A device with serial ' + serial)
+        return entry
+
+    def get(self, serial):
+        # mcp2221a object by chip factory serial number or USB serial number descriptor string
+        return self.find(serial).device
+
+    def run(self, function, entries):
+        # function(entry) for every entry in parallel, returns list of results in the same order
+        if len(entries) <= 1:
+            return [function(entry) for entry in entries]
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.maxWorkers or len(self.entries))
+        return list(self.executor.map(function, entries))
+
+    def runAll(self, operation, serials=None):
+        # operation(mcp2221a) on every chip (or only on chips in serials) in parallel
+        # Returns list of deviceResult in the order of the chips (of serials), serial is None for chips that could
+        # not be opened
+        entries = self.entries if serials is None else [self.find(serial) for serial in serials]
+
+        def runOne(entry):
+            timeStart = time.perf_counter()
+            value = None
+            error = None
+            serial = None
+            try:
+                with entry.lock:
+                    serial = entry.factorySerial
+                    value = operation(entry.device)
+            except Exception as e:
+                error = e
+            return deviceResult(serial, value, error, time.perf_counter() - timeStart)
+
+        return self.run(runOne, entries)
+
+    def getStatusAll(self, serials=None):
+        return self.runAll(lambda mcp2221a: mcp2221a.getStatus(), serials)
+
+    def writeGPsAll(self, values, serials=None):
+        return self.runAll(lambda mcp2221a: mcp2221a.writeGPs(values), serials)
+
+    def writeFlashGpSettingsAll(self, gpSettings, serials=None):
+        return self.runAll(lambda mcp2221a: mcp2221a.writeFlashGpSettings(gpSettings), serials)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
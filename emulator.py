@@ -0,0 +1,441 @@
+# Software MCP2221A, answers the same 64 byte HID reports as the real chip
+# Usage: mcp2221a = MCP2221A.mcp2221a(emulator.mcp2221aEmulator())
+import MCP2221A
+import collections
+import itertools
+import time
+
+CHIP_FACTORY_SERIAL_NUMBER = "01234567"  # Factory serial number of the first emulator, the next ones count up
+factorySerials = itertools.count(int(CHIP_FACTORY_SERIAL_NUMBER))
+
+class i2cEeprom(object):
+    # Simulated I2C EEPROM (24LCxx like): write sets the address pointer (addressBytes, big-endian) followed by data,
+    # read continues from the address pointer
+    def __init__(self, size=65536, addressBytes=2):
+        self.memory = bytearray(size)
+        self.addressBytes = addressBytes
+        self.pointer = 0
+
+    def write(self, data):
+        if len(data) < self.addressBytes:
+            return
+        self.pointer = int.from_bytes(data[:self.addressBytes], 'big') % len(self.memory)
+        for x in data[self.addressBytes:]:
+            self.memory[self.pointer] = x
+            self.pointer = (self.pointer + 1) % len(self.memory)
+
+    def read(self, length):
+        data = bytearray(length)
+        for i in range(length):
+            data[i] = self.memory[self.pointer]
+            self.pointer = (self.pointer + 1) % len(self.memory)
+        return data
+
+class mcp2221aEmulator(MCP2221A.transport):
+
+    def __init__(self, latency=0, powerUpTime=0):
+        # latency     - seconds between writing a request and its reply being readable (emulates USB frame/hub delay)
+        # powerUpTime - seconds between CMD_RESET and the chip being ready again
+        self.latency = latency
+        self.powerUpTime = powerUpTime
+        self.transactions = 0  # Number of reports written to the chip
+        self.resets = 0
+        self.replies = collections.deque()
+        self.dropReplies = 0  # Fault injection (injectFaults())
+        self.replyDelays = collections.deque()
+
+        # Flash image
+        self.flashChipSettings = bytearray([
+            0x80,  # Provide serial number on enumeration, unsecured
+            0x12,  # Clock output duty cycle/divider
+            0x00,  # DAC reference/power-up value
+            0x00,  # ADC reference, interrupt edges
+            0xD8, 0x04,  # USB vendorID
+            0xDD, 0x00,  # USB productID
+            0x80,  # USB power attributes
+            50,    # USB requested number of mA / 2
+        ])
+        self.flashPassword = bytearray(8)
+        self.flashGpSettings = bytearray([0x08, 0x08, 0x08, 0x08])  # All GPIO inputs
+        self.flashDescriptors = {
+            MCP2221A.READ_USB_MANUFACTURER_DESCRIPTOR_STRING: "Microchip Technology Inc.",
+            MCP2221A.READ_USB_PRODUCT_DESCRIPTOR_STRING: "MCP2221 USB-I2C/UART Combo",
+            MCP2221A.READ_USB_SERIAL_NUMBER_DESCRIPTOR_STRING: "0000000000",
+        }
+        self.factorySerial = '%08u' % next(factorySerials)
+
+        # Pin levels driven from outside while a GP is an input
+        self.inputs = [0]*4
+        # Loopback wiring: input GP -> output GP driving it (connect())
+        self.wires = dict()
+        # Voltage on GPx seen by the ADC, a number or a function of time (time.perf_counter())
+        self.analogInputs = [0.0]*4
+        self.vdd = 3.3
+
+        # I2C slaves: 7 bit address -> object with write(data) and read(length)
+        self.i2cTargets = dict()
+        self.i2cDivider = 117  # 100 kHz
+        self.i2cReset()
+
+        self.powerUp()
+
+    def powerUp(self):
+        # SRAM is loaded from flash at power-up/reset
+        self.sramChipSettings = bytearray(self.flashChipSettings)
+        self.sramGpSettings = bytearray(self.flashGpSettings)
+        self.gpOutput = [(x >> 4) & 1 for x in self.sramGpSettings]
+        self.gpDirection = [(x >> 3) & 1 for x in self.sramGpSettings]
+        self.dacValue = self.sramChipSettings[2] & 0x1F
+        self.interruptFlag = 0
+        self.replies.clear()
+
+    def i2cReset(self):
+        self.i2cState = MCP2221A.I2C_STATE_IDLE
+        self.i2cNack = 0
+        self.i2cAddress = 0
+        self.i2cLength = 0
+        self.i2cData = bytearray()    # Data of the write in progress / data read from the slave
+        self.i2cTransferred = 0       # Bytes written to the slave / read by the host
+        self.i2cBusyUntil = 0         # Time the I2C engine finishes clocking out the last chunk
+
+    def i2cBusTime(self, length):
+        # Seconds needed to clock length bytes (9 clocks per byte) on the I2C bus
+        return (length + 1)*9*(self.i2cDivider + 3)/12000000.0
+
+    def setInput(self, pin, value):
+        value = 1 if value else 0
+        if pin == 1 and (self.sramGpSettings[1] & 0x07) == MCP2221A.GP_DESIGNATION_INTERRUPT:
+            # Interrupt-on-change detection latches enabled edges until the flag is cleared
+            if value > self.inputs[1] and self.sramChipSettings[3] & 0x40:
+                self.interruptFlag = 1
+            if value < self.inputs[1] and self.sramChipSettings[3] & 0x20:
+                self.interruptFlag = 1
+        self.inputs[pin] = value
+
+    def connect(self, outputPin, inputPin):
+        # Wire GP outputPin to GP inputPin (loopback), inputPin follows outputPin while it is an output
+        self.wires[inputPin] = outputPin
+        self.driveWires()
+
+    def driveWires(self):
+        for inputPin, outputPin in self.wires.items():
+            if self.gpDirection[outputPin] == 0:
+                self.setInput(inputPin, self.gpOutput[outputPin])
+
+    def pulse(self, pin):
+        self.setInput(pin, 1)
+        self.setInput(pin, 0)
+
+    def pinLevel(self, pin):
+        if self.gpDirection[pin] == 0:
+            return self.gpOutput[pin]
+        return self.inputs[pin]
+
+    def isGpio(self, pin):
+        return (self.sramGpSettings[pin] & 0x07) == 0
+
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode('latin-1')
+        request = bytearray(buf)
+        request.extend(bytes(MCP2221A.HID_PKT_SIZE - len(request)))
+        self.transactions += 1
+        reply = self.handle(request)
+        if reply is not None:
+            if self.dropReplies:
+                self.dropReplies -= 1  # Lost on the bus
+                return
+            # Reply becomes readable latency seconds after the request was written,
+            # so pipelined requests overlap their latency like on a real bus
+            delay = self.latency
+            if self.replyDelays:
+                delay += self.replyDelays.popleft()
+            self.replies.append((time.perf_counter() + delay, reply))
+
+    def injectFaults(self, drop=0, delays=()):
+        # drop   - number of next replies that are lost
+        # delays - extra seconds added to the next replies (late replies)
+        self.dropReplies += drop
+        self.replyDelays.extend(delays)
+
+    def read(self, timeout=None):
+        # timeout - ms, None - wait as long as the reply needs
+        if not self.replies:
+            if timeout:
+                time.sleep(timeout / 1000.0)
+            raise TimeoutError('MCP2221A emulator: no reply')
+        readyTime, reply = self.replies[0]
+        delay = readyTime - time.perf_counter()
+        if timeout is not None and delay > timeout / 1000.0:
+            time.sleep(timeout / 1000.0)
+            raise TimeoutError('MCP2221A emulator: reply timeout')
+        self.replies.popleft()
+        if delay > 0:
+            time.sleep(delay)
+        return reply
+
+    def readInto(self, buf, timeout=None):
+        reply = self.read(timeout)
+        memoryview(buf)[:len(reply)] = reply
+        return len(reply)
+
+    def reconnect(self):
+        if self.powerUpTime:
+            time.sleep(self.powerUpTime)
+
+    def handle(self, request):
+        reply = bytearray(MCP2221A.HID_PKT_SIZE)
+        reply[0] = request[0]
+        cmd = request[0]
+        if cmd == 0x10:
+            self.status(request, reply)
+        elif cmd == MCP2221A.CMD_READ:
+            self.readFlash(request, reply)
+        elif cmd == MCP2221A.CMD_WRITE:
+            self.writeFlash(request, reply)
+        elif cmd == MCP2221A.SET_GPIO_OUTPUT_VALUES:
+            self.setGpio(request, reply)
+        elif cmd == MCP2221A.GET_GPIO_VALUES:
+            self.getGpio(request, reply)
+        elif cmd == MCP2221A.SET_SRAM_SETTINGS:
+            self.setSram(request, reply)
+        elif cmd == MCP2221A.GET_SRAM_SETTINGS:
+            self.getSram(request, reply)
+        elif cmd in (MCP2221A.I2C_WRITE_DATA, MCP2221A.I2C_WRITE_DATA_REPEATED_START, MCP2221A.I2C_WRITE_DATA_NO_STOP):
+            self.i2cWrite(request, reply)
+        elif cmd in (MCP2221A.I2C_READ_DATA, MCP2221A.I2C_READ_DATA_REPEATED_START):
+            self.i2cRead(request, reply)
+        elif cmd == MCP2221A.I2C_GET_DATA:
+            self.i2cGetData(request, reply)
+        elif cmd == MCP2221A.CMD_RESET:
+            if request[1:4] == b'\xAB\xCD\xEF':
+                self.resets += 1
+                self.powerUp()
+                return None  # Chip resets without answering
+            reply[1] = 0x01
+        else:
+            reply[1] = 0x01  # Unknown command
+        return reply
+
+    def status(self, request, reply):
+        if request[2] == MCP2221A.I2C_CANCEL_TRANSFER:
+            if self.i2cState == MCP2221A.I2C_STATE_IDLE and not self.i2cNack:
+                reply[2] = 0x11  # Already idle
+            else:
+                reply[2] = 0x10
+            self.i2cReset()
+        if request[3] == MCP2221A.I2C_SET_SPEED:
+            if self.i2cState == MCP2221A.I2C_STATE_IDLE:
+                self.i2cDivider = request[4]
+                reply[3] = 0x20
+            else:
+                reply[3] = 0x21
+        reply[4] = self.i2cDivider
+        if self.i2cState in (MCP2221A.I2C_STATE_PARTIAL_DATA, MCP2221A.I2C_STATE_WRITING_NO_STOP) and \
+                time.perf_counter() >= self.i2cBusyUntil:
+            self.i2cWriteDone()
+        reply[8] = self.i2cState
+        reply[9:11] = self.i2cLength.to_bytes(2, 'little')
+        reply[11:13] = self.i2cTransferred.to_bytes(2, 'little')
+        reply[14] = self.i2cDivider
+        reply[16:18] = (self.i2cAddress << 1).to_bytes(2, 'little')
+        reply[20] = MCP2221A.I2C_ADDRESS_NACK_MASK if self.i2cNack else 0
+        for channel in (1, 2, 3):
+            value = self.adcValue(channel)
+            reply[48 + 2*channel] = value & 0xFF
+            reply[49 + 2*channel] = value >> 8
+        reply[22] = 1  # SCL
+        reply[23] = 1  # SDA
+        reply[24] = self.interruptFlag
+        reply[46:50] = b'A612'  # HW/FW revision
+
+    def vref(self, setting):
+        # setting - bits 2-1 VRM level, bit 0 reference source (as in SET_SRAM_SETTINGS)
+        if setting & 0x01 and setting >> 1:
+            return (0, 1.024, 2.048, 4.096)[setting >> 1]
+        return self.vdd
+
+    def adcValue(self, channel):
+        if (self.sramGpSettings[channel] & 0x07) != MCP2221A.GP_DESIGNATION_ADC:
+            return 0
+        voltage = self.analogInputs[channel]
+        if callable(voltage):
+            voltage = voltage(time.perf_counter())
+        value = int(round(voltage / self.vref((self.sramChipSettings[3] >> 2) & 0x07) * 1023))
+        return max(0, min(1023, value))
+
+    def readFlash(self, request, reply):
+        section = request[1]
+        if section == MCP2221A.READ_CHIP_SETTINGS:
+            reply[2] = len(self.flashChipSettings)
+            reply[4:4 + len(self.flashChipSettings)] = self.flashChipSettings
+        elif section == MCP2221A.READ_GP_SETTINGS:
+            reply[2] = 4
+            reply[4:8] = self.flashGpSettings
+        elif section in self.flashDescriptors:
+            data = self.flashDescriptors[section].encode('utf-16-le')
+            reply[2] = len(data) + 2
+            reply[3] = 0x03
+            reply[4:4 + len(data)] = data
+        elif section == MCP2221A.READ_CHIP_FACTORY_SERIAL_NUMBER:
+            data = self.factorySerial.encode('ascii')
+            reply[2] = len(data)
+            reply[4:4 + len(data)] = data
+        else:
+            reply[1] = 0x01
+
+    def writeFlash(self, request, reply):
+        section = request[1]
+        if section == 0x00:  # Write chip settings
+            self.flashChipSettings[:] = request[2:12]
+            self.flashPassword[:] = request[12:20]
+        elif section == MCP2221A.WRITE_GP_SETTINGS:
+            self.flashGpSettings[:] = request[2:6]
+        elif section in self.flashDescriptors:
+            if request[3] != 0x03 or request[2] < 2 or request[2] > 62:
+                reply[1] = 0x02
+                return
+            self.flashDescriptors[section] = bytes(request[4:2 + request[2]]).decode('utf-16-le')
+        else:
+            reply[1] = 0x02
+
+    def i2cWrite(self, request, reply):
+        now = time.perf_counter()
+        if now < self.i2cBusyUntil:
+            reply[1] = 0x01  # Engine busy, previous chunk not yet on the bus
+            reply[2] = self.i2cState
+            return
+        length = request[1] | (request[2] << 8)
+        if self.i2cState != MCP2221A.I2C_STATE_PARTIAL_DATA:
+            # New transfer
+            if self.i2cState not in (MCP2221A.I2C_STATE_IDLE, MCP2221A.I2C_STATE_WRITING_NO_STOP):
+                reply[1] = 0x01
+                reply[2] = self.i2cState
+                return
+            self.i2cReset()
+            self.i2cLength = length
+            self.i2cAddress = request[3] >> 1
+            self.i2cCommand = request[0]
+            if self.i2cAddress not in self.i2cTargets:
+                self.i2cNack = 1
+                self.i2cState = MCP2221A.I2C_STATE_ADDRESS_NACK
+                return
+        chunk = request[4:4 + min(MCP2221A.I2C_MAX_CHUNK, self.i2cLength - self.i2cTransferred)]
+        self.i2cData.extend(chunk)
+        self.i2cTransferred += len(chunk)
+        self.i2cBusyUntil = now + self.i2cBusTime(len(chunk))
+        self.i2cState = MCP2221A.I2C_STATE_PARTIAL_DATA
+        if self.i2cTransferred >= self.i2cLength and self.i2cBusyUntil <= now:
+            self.i2cWriteDone()
+
+    def i2cWriteDone(self):
+        if self.i2cState == MCP2221A.I2C_STATE_PARTIAL_DATA and self.i2cTransferred >= self.i2cLength:
+            self.i2cTargets[self.i2cAddress].write(bytes(self.i2cData))
+            if self.i2cCommand == MCP2221A.I2C_WRITE_DATA_NO_STOP:
+                self.i2cState = MCP2221A.I2C_STATE_WRITING_NO_STOP
+            else:
+                self.i2cState = MCP2221A.I2C_STATE_IDLE
+
+    def i2cRead(self, request, reply):
+        now = time.perf_counter()
+        if self.i2cState in (MCP2221A.I2C_STATE_PARTIAL_DATA, MCP2221A.I2C_STATE_WRITING_NO_STOP) and \
+                now >= self.i2cBusyUntil:
+            self.i2cWriteDone()
+        if self.i2cState == MCP2221A.I2C_STATE_WRITING_NO_STOP:
+            if request[0] != MCP2221A.I2C_READ_DATA_REPEATED_START:
+                reply[1] = 0x01
+                reply[2] = self.i2cState
+                return
+        elif self.i2cState != MCP2221A.I2C_STATE_IDLE or now < self.i2cBusyUntil:
+            reply[1] = 0x01
+            reply[2] = self.i2cState
+            return
+        self.i2cReset()
+        self.i2cLength = request[1] | (request[2] << 8)
+        self.i2cAddress = request[3] >> 1
+        if self.i2cAddress not in self.i2cTargets:
+            self.i2cNack = 1
+            self.i2cState = MCP2221A.I2C_STATE_ADDRESS_NACK
+            return
+        self.i2cData = self.i2cTargets[self.i2cAddress].read(self.i2cLength)
+        self.i2cReadStart = now
+        self.i2cState = MCP2221A.I2C_STATE_READ_PARTIAL
+
+    def i2cGetData(self, request, reply):
+        reply[2] = self.i2cState
+        if self.i2cState == MCP2221A.I2C_STATE_ADDRESS_NACK:
+            reply[1] = 0x41
+            reply[3] = MCP2221A.I2C_READ_ERROR
+            return
+        if self.i2cState != MCP2221A.I2C_STATE_READ_PARTIAL:
+            reply[1] = 0x41
+            reply[3] = MCP2221A.I2C_READ_ERROR
+            return
+        # Bytes clocked in from the slave so far
+        clocked = int((time.perf_counter() - self.i2cReadStart)/self.i2cBusTime(0)) - 1
+        available = min(clocked, self.i2cLength) - self.i2cTransferred
+        if available < min(MCP2221A.I2C_MAX_CHUNK, self.i2cLength - self.i2cTransferred):
+            reply[1] = 0x41  # Data not yet ready
+            return
+        count = min(MCP2221A.I2C_MAX_CHUNK, self.i2cLength - self.i2cTransferred)
+        reply[3] = count
+        reply[4:4 + count] = self.i2cData[self.i2cTransferred:self.i2cTransferred + count]
+        self.i2cTransferred += count
+        if self.i2cTransferred >= self.i2cLength:
+            self.i2cState = MCP2221A.I2C_STATE_IDLE
+            reply[2] = MCP2221A.I2C_STATE_READ_COMPLETE
+
+    def setGpio(self, request, reply):
+        for pin in range(4):
+            i = 2 + pin*4
+            reply[i:i + 4] = request[i:i + 4]
+            if not self.isGpio(pin):
+                if request[i] or request[i + 2]:
+                    reply[i:i + 4] = b'\xEE\xEE\xEE\xEE'
+                continue
+            if request[i]:
+                self.gpOutput[pin] = request[i + 1] & 1
+            if request[i + 2]:
+                self.gpDirection[pin] = request[i + 3] & 1
+        self.driveWires()
+
+    def getGpio(self, request, reply):
+        for pin in range(4):
+            if self.isGpio(pin):
+                reply[2 + pin*2] = self.pinLevel(pin)
+                reply[3 + pin*2] = self.gpDirection[pin]
+            else:
+                reply[2 + pin*2] = 0xEE
+                reply[3 + pin*2] = 0xEE
+
+    def setSram(self, request, reply):
+        if request[2] & 0x80:  # Clock output divider
+            self.sramChipSettings[1] = request[2] & 0x1F
+        if request[3] & 0x80:  # DAC voltage reference
+            self.sramChipSettings[2] = (self.sramChipSettings[2] & 0x1F) | ((request[3] & 0x07) << 5)
+        if request[4] & 0x80:  # DAC output value
+            self.dacValue = request[4] & 0x1F
+        if request[5] & 0x80:  # ADC voltage reference
+            self.sramChipSettings[3] = (self.sramChipSettings[3] & 0xE3) | ((request[5] & 0x07) << 2)
+        if request[6] & 0x80:  # Interrupt detection
+            if request[6] & 0x10:
+                self.sramChipSettings[3] = (self.sramChipSettings[3] & ~0x40) | ((request[6] & 0x08) << 3)
+            if request[6] & 0x04:
+                self.sramChipSettings[3] = (self.sramChipSettings[3] & ~0x20) | ((request[6] & 0x02) << 4)
+        if request[6] & 0x01:
+            self.interruptFlag = 0
+        if request[7] & 0x80:  # GP designation
+            self.sramGpSettings[:] = request[8:12]
+            for pin in range(4):
+                self.gpOutput[pin] = (request[8 + pin] >> 4) & 1
+                self.gpDirection[pin] = (request[8 + pin] >> 3) & 1
+            self.driveWires()
+
+    def getSram(self, request, reply):
+        reply[2] = len(self.sramChipSettings)
+        reply[3] = len(self.sramGpSettings)
+        reply[4:14] = self.sramChipSettings
+        reply[14:22] = self.flashPassword
+        for pin in range(4):
+            setting = self.sramGpSettings[pin] & 0xE7
+            reply[22 + pin] = setting | (self.gpOutput[pin] << 4) | (self.gpDirection[pin] << 3)
@@ -0,0 +1,138 @@
+# Flash settings object model
+# Every flash section (chip settings, GP settings, the three USB descriptor strings) is read once into compact
+# ctypes structures, edited in memory (pins are indexed: settings.gp[pin].direction = 1) and written back with
+# commit(), which only writes sections that differ from what was read.
+#
+# Usage:
+#     settings = flashSettings.flashSettings(mcp2221a)
+#     for pin in range(4):
+#         settings.setPin(pin, designation=0, direction=0, outputVal=1)
+#     settings.chip.ledI2c = 1
+#     settings.product = 'Rack controller'
+#     settings.commit()  # Writes GP settings, chip settings and product descriptor, one report each
+import MCP2221A
+import ctypes
+
+class chipSettings_S(ctypes.LittleEndianStructure):
+    # Chip settings, as in READ_CHIP_SETTINGS reply bytes 4-13
+    _pack_ = 1
+    _fields_ = [
+        ("security", ctypes.c_uint8, 2),                 # 0: Chip security (never changed by commit())
+        ("usbcfg", ctypes.c_uint8, 1),
+        ("sspnd", ctypes.c_uint8, 1),
+        ("ledI2c", ctypes.c_uint8, 1),
+        ("ledUartTx", ctypes.c_uint8, 1),
+        ("ledUartRx", ctypes.c_uint8, 1),
+        ("serialNumberEnumeration", ctypes.c_uint8, 1),
+        ("clockDivider", ctypes.c_uint8, 3),             # 1: Clock output
+        ("clockDutyCycle", ctypes.c_uint8, 2),
+        ("notUsed1", ctypes.c_uint8, 3),
+        ("dacValue", ctypes.c_uint8, 5),                 # 2: DAC power-up value and reference
+        ("dacVrm", ctypes.c_uint8, 1),
+        ("dacVref", ctypes.c_uint8, 2),
+        ("notUsed3", ctypes.c_uint8, 2),                 # 3: ADC reference, interrupt edges
+        ("adcVrm", ctypes.c_uint8, 1),
+        ("adcVref", ctypes.c_uint8, 2),
+        ("interruptNegativeEdge", ctypes.c_uint8, 1),
+        ("interruptPositiveEdge", ctypes.c_uint8, 1),
+        ("notUsed3b", ctypes.c_uint8, 1),
+        ("vendorId", ctypes.c_uint16),                   # 4-5
+        ("productId", ctypes.c_uint16),                  # 6-7
+        ("powerAttributes", ctypes.c_uint8),             # 8
+        ("requestedCurrent", ctypes.c_uint8),            # 9: mA / 2
+    ]
+
+gpSettingsArray = MCP2221A.gpSetting_S * 4
+
+DESCRIPTORS = (
+    ('manufacturer', 'Manufacturer', MCP2221A.READ_USB_MANUFACTURER_DESCRIPTOR_STRING),
+    ('product', 'Product', MCP2221A.READ_USB_PRODUCT_DESCRIPTOR_STRING),
+    ('serial', 'Serial', MCP2221A.READ_USB_SERIAL_NUMBER_DESCRIPTOR_STRING),
+)
+
+class flashSettings(object):
+    __slots__ = ('mcp2221a', 'chip', 'gp', 'descriptors', 'flashChip', 'flashGp', 'flashDescriptors')
+
+    def __init__(self, mcp2221a, load=True):
+        self.mcp2221a = mcp2221a
+        if load:
+            self.load()
+
+    def load(self):
+        # One read per section (served from the mcp2221a flash cache when it was already read)
+        device = self.mcp2221a
+        self.flashChip = device.readFlash(MCP2221A.READ_CHIP_SETTINGS)[4:4 + MCP2221A.CHIP_SETTINGS_SIZE]
+        self.flashGp = device.readFlash(MCP2221A.READ_GP_SETTINGS)[4:8]
+        self.flashDescriptors = dict((name, device.readDescriptorString(section))
+                                     for name, descriptor, section in DESCRIPTORS)
+        self.chip = chipSettings_S.from_buffer_copy(self.flashChip)
+        self.gp = gpSettingsArray.from_buffer_copy(self.flashGp)
+        self.descriptors = dict(self.flashDescriptors)
+        return self
+
+    def reload(self):
+        # Read every section from the chip again, edits are lost
+        self.mcp2221a.invalidateFlashCache()
+        return self.load()
+
+    def setPin(self, pin, designation=None, direction=None, outputVal=None):
+        # Power-up settings of GPx, None - keep
+        setting = self.gp[pin]
+        if designation is not None:
+            setting.designation = designation
+        if direction is not None:
+            setting.direction = direction
+        if outputVal is not None:
+            setting.outputVal = outputVal
+
+    @property
+    def manufacturer(self):
+        return self.descriptors['manufacturer']
+
+    @manufacturer.setter
+    def manufacturer(self, value):
+        self.descriptors['manufacturer'] = value
+
+    @property
+    def product(self):
+        return self.descriptors['product']
+
+    @product.setter
+    def product(self, value):
+        self.descriptors['product'] = value
+
+    @property
+    def serial(self):
+        return self.descriptors['serial']
+
+    @serial.setter
+    def serial(self, value):
+        self.descriptors['serial'] = value
+
+    def dirty(self):
+        # Sections edited since load()/commit(): 'chip', 'gp', 'manufacturer', 'product', 'serial'
+        sections = []
+        if bytes(self.chip) != self.flashChip:
+            sections.append('chip')
+        if bytes(self.gp) != self.flashGp:
+            sections.append('gp')
+        sections += [name for name, descriptor, section in DESCRIPTORS
+                     if self.descriptors[name] != self.flashDescriptors[name]]
+        return sections
+
+    def commit(self):
+        # Write dirty sections (one report each), returns their names
+        device = self.mcp2221a
+        written = self.dirty()
+        for name in written:
+            if name == 'chip':
+                device.writeFlashChipSettings(bytes(self.chip))
+                self.flashChip = bytes(self.chip)
+            elif name == 'gp':
+                device.writeFlashGpSettings(MCP2221A.gpSettings_U.from_buffer_copy(self.gp))
+                self.flashGp = bytes(self.gp)
+        for name, descriptor, section in DESCRIPTORS:
+            if name in written:
+                device.writeDescriptor(self.descriptors[name], descriptor)
+                self.flashDescriptors[name] = self.descriptors[name]
+        return written
@@ -0,0 +1,148 @@
+# Loopback GPIO benchmark: write-to-readback latency, toggle rate and readGP sample rate
+# An output GP is wired to an input GP (on a real chip with a jumper, the emulated chip is wired with connect()).
+# - latency:    writeGPs() of a new level, then readGP() until the input shows it; percentiles of the time from
+#               the start of the write to the reply showing the level, and readGP() calls needed
+# - toggle:     output toggles per second with writeGPs() (one transaction each) and with a pre-encoded
+#               gpioSequencer clock (pipelined, pipelineDepth reports in flight)
+# - sample:     readGP() calls per second
+# Run: python3 gpioBenchmark.py --emulate --latency 0.001 --json gpio.json
+#      python3 gpioBenchmark.py --output-pin 0 --input-pin 1 --iterations 1000   (real chip, GP0 wired to GP1)
+import MCP2221A
+import emulator
+import gpioSequencer
+import argparse
+import json
+import platform
+import time
+
+LATENCY_TIMEOUT = 0.1  # Seconds a written level may take to show up on the input
+PERCENTILES = [50, 90, 99]
+
+def percentile(values, p):
+    # Nearest-rank percentile of sorted values
+    index = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))
+    return values[index]
+
+def setup(mcp2221a, outputPin, inputPin):
+    # Both pins as GPIO in one SRAM transaction, output starts low
+    mcp2221a.configureSram(MCP2221A.sramConfig().output(outputPin, 0).input(inputPin))
+
+def measureLatency(mcp2221a, outputPin, inputPin, iterations, timeout=LATENCY_TIMEOUT):
+    latencies = []
+    polls = 0
+    timeouts = 0
+    values = [None]*4
+    for i in range(iterations):
+        level = (i + 1) & 1
+        values[outputPin] = level
+        start = time.perf_counter()
+        mcp2221a.writeGPs(values, force=True)
+        while True:
+            state = mcp2221a.readGP()
+            polls += 1
+            now = time.perf_counter()
+            if state[inputPin] == level:
+                latencies.append(now - start)
+                break
+            if now - start > timeout:
+                timeouts += 1
+                break
+    result = {
+        'samples': len(latencies),
+        'timeouts': timeouts,
+        'readsPerSample': polls / iterations,
+    }
+    if latencies:
+        latencies.sort()
+        result['meanUs'] = sum(latencies) / len(latencies) * 1e6
+        for p in PERCENTILES:
+            result['p%uUs' % p] = percentile(latencies, p) * 1e6
+        result['maxUs'] = latencies[-1] * 1e6
+    return result
+
+def measureToggleRate(mcp2221a, outputPin, iterations, pipelineDepth):
+    values = [None]*4
+    start = time.perf_counter()
+    for i in range(iterations):
+        values[outputPin] = (i + 1) & 1
+        mcp2221a.writeGPs(values, force=True)
+    elapsed = time.perf_counter() - start
+    clock = gpioSequencer.clock(outputPin, max(1, iterations // 2))
+    stats = clock.run(mcp2221a, pipelineDepth=pipelineDepth)
+    return {
+        'writeGPsPerSec': iterations / elapsed,
+        'sequencerTogglesPerSec': stats['stepRate'],
+        'sequencerErrors': stats['errors'],
+        'pipelineDepth': pipelineDepth,
+    }
+
+def measureSampleRate(mcp2221a, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        mcp2221a.readGP()
+    elapsed = time.perf_counter() - start
+    return {
+        'readGPPerSec': iterations / elapsed,
+        'usPerRead': elapsed / iterations * 1e6,
+    }
+
+def openDevice(emulate, latency, serial, outputPin, inputPin):
+    if emulate:
+        chip = emulator.mcp2221aEmulator(latency=latency)
+        chip.connect(outputPin, inputPin)
+        return MCP2221A.mcp2221a(chip)
+    if serial is not None:
+        return MCP2221A.mcp2221a(MCP2221A.usbTransport(serial=serial))
+    return MCP2221A.mcp2221a()
+
+def runAll(mcp2221a, outputPin, inputPin, iterations, pipelineDepth=4):
+    setup(mcp2221a, outputPin, inputPin)
+    mcp2221a.readGP()  # Warm up
+    return {
+        'latency': measureLatency(mcp2221a, outputPin, inputPin, iterations),
+        'toggle': measureToggleRate(mcp2221a, outputPin, iterations, pipelineDepth),
+        'sample': measureSampleRate(mcp2221a, iterations),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MCP2221A loopback GPIO benchmark')
+    parser.add_argument('--emulate', action='store_true', help='Use the emulated chip instead of USB')
+    parser.add_argument('--latency', type=float, default=0, help='Emulated latency per transaction [s]')
+    parser.add_argument('--serial', help='Serial number of the chip to use')
+    parser.add_argument('--output-pin', type=int, default=0, help='GP driving the loopback')
+    parser.add_argument('--input-pin', type=int, default=1, help='GP reading the loopback')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--pipeline-depth', type=int, default=4, help='Reports in flight for the sequencer toggle')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    args = parser.parse_args()
+    if args.output_pin == args.input_pin or not (0 <= args.output_pin < 4 and 0 <= args.input_pin < 4):
+        parser.error('--output-pin and --input-pin must be two different GPs (0-3)')
+
+    mcp2221a = openDevice(args.emulate, args.latency, args.serial, args.output_pin, args.input_pin)
+    results = runAll(mcp2221a, args.output_pin, args.input_pin, args.iterations, args.pipeline_depth)
+
+    latency = results['latency']
+    print("Write-to-readback GP%u -> GP%u (%u samples, %u timeouts, %.2f reads/sample)" % (
+        args.output_pin, args.input_pin, latency['samples'], latency['timeouts'], latency['readsPerSample']))
+    if latency['samples']:
+        print("  mean %.1f us, p50 %.1f us, p90 %.1f us, p99 %.1f us, max %.1f us" % (
+            latency['meanUs'], latency['p50Us'], latency['p90Us'], latency['p99Us'], latency['maxUs']))
+    toggle = results['toggle']
+    print("Toggle rate: writeGPs %.1f /s, sequencer %.1f /s (pipeline depth %u)" % (
+        toggle['writeGPsPerSec'], toggle['sequencerTogglesPerSec'], toggle['pipelineDepth']))
+    sample = results['sample']
+    print("readGP: %.1f /s (%.1f us/read)" % (sample['readGPPerSec'], sample['usPerRead']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'device': 'emulator' if args.emulate else 'usb',
+                'latency': args.latency if args.emulate else None,
+                'outputPin': args.output_pin,
+                'inputPin': args.input_pin,
+                'iterations': args.iterations,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results,
+            }, f, indent=2)
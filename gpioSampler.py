@@ -0,0 +1,85 @@
+# Background GPIO sampler
+# Polls GET_GPIO_VALUES back-to-back (or with a fixed period) from its own thread and keeps
+# timestamped samples in a ring buffer. Bit x of every sample is the value of GPx.
+# While running the sampler owns the device, do not use the mcp2221a object from other threads.
+import MCP2221A
+import ringBuffer
+import sampler
+import collections
+import threading
+import time
+
+class gpioSampler(sampler.pollingSampler):
+
+    def __init__(self, mcp2221a, size=100000, period=0, useNumpy=False, maxEdges=10000):
+        # size     - number of samples kept in the ring buffer
+        # period   - seconds between samples, 0 polls as fast as USB allows
+        # maxEdges - number of detected edges kept
+        sampler.pollingSampler.__init__(self, mcp2221a, MCP2221A.GET_GPIO_VALUES_COMMAND, period)
+        self.samples = ringBuffer.ringBuffer(size, 1, 'B', useNumpy)
+        self.append = self.samples.append
+        self.edges = collections.deque(maxlen=maxEdges)  # (timestamp, pin, new value)
+        self.edgeCount = 0  # Number of edges ever detected
+        self.callbacks = []
+        self.edgeCondition = threading.Condition()
+        self.last = None
+
+    def onEdge(self, callback, pin=None, level=None):
+        # callback(timestamp, pin, value) is called from the sampler thread for every edge
+        # pin   - only edges on this GP (None - all pins)
+        # level - only rising (1) or falling (0) edges (None - both)
+        self.callbacks.append((callback, pin, level))
+
+    def process(self, t, info):
+        # 0xEE (pin not set for GPIO operation) is read as 0
+        state = ((info[2] & 1) | (info[4] & 1) << 1 | (info[6] & 1) << 2 | (info[8] & 1) << 3)
+        self.append(t, state)
+        if self.last is not None and state != self.last:
+            self.edgeDetected(t, self.last, state)
+        self.last = state
+
+    def edgeDetected(self, t, last, state):
+        changed = last ^ state
+        with self.edgeCondition:
+            for pin in range(4):
+                if changed & (1 << pin):
+                    value = (state >> pin) & 1
+                    self.edges.append((t, pin, value))
+                    self.edgeCount += 1
+                    for callback, cbPin, cbLevel in self.callbacks:
+                        if (cbPin is None or cbPin == pin) and (cbLevel is None or cbLevel == value):
+                            callback(t, pin, value)
+            self.edgeCondition.notify_all()
+
+    def waitForEdge(self, pin=None, level=None, timeout=None):
+        # Block until the next edge (after this call), returns (timestamp, pin, value) or None on timeout
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.edgeCondition:
+            seen = self.edgeCount
+            while True:
+                new = min(self.edgeCount - seen, len(self.edges))
+                for edge in list(self.edges)[len(self.edges) - new:]:
+                    if (pin is None or edge[1] == pin) and (level is None or edge[2] == level):
+                        return edge
+                seen = self.edgeCount
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.edgeCondition.wait(remaining)
+
+    def pinSamples(self, pin):
+        # (timestamps, values) of GPx from the ring buffer, oldest first
+        times, data = self.samples.snapshot()
+        if self.samples.useNumpy:
+            return times, (data[:, 0] >> pin) & 1
+        return times, [(x >> pin) & 1 for x in data]
+
+    def stats(self):
+        output = sampler.pollingSampler.stats(self)
+        output.update({
+            'samples': self.samples.count,
+            'sampleRate': output['pollRate'],
+            'edges': self.edgeCount,
+            'overwritten': self.samples.overwritten(),
+        })
+        return output
@@ -0,0 +1,70 @@
+# GPIO output pattern sequencer
+# A sequence of 4-pin output states is encoded into SET_GPIO_OUTPUT_VALUES reports once, playback (reportPlayer)
+# only sends the ready reports, back-to-back (optionally pipelined) or with per-step delays against a monotonic
+# clock. Sequences are reusable, replaying one costs no encoding.
+#
+# Usage:
+#     clock = gpioSequencer.gpioSequence([[1, None, None, None], [0, None, None, None]])
+#     print(clock.run(mcp2221a, loops=1000))  # Blocking, returns stats (stepRate, jitter, errors)
+#     player = clock.play(mcp2221a, loops=0)  # Background thread until player.stop()
+import MCP2221A
+import reportPlayer
+
+class gpioSequence(object):
+
+    def __init__(self, states, period=0, delays=None, pins=0b1111):
+        # states - per step either 4 output values (None - GPx untouched) or an int with bit x the value of GPx,
+        #          int states only write pins set in pins mask
+        # period - seconds between steps (0 - back-to-back), delays - seconds after every step (overrides period)
+        self.states = [self.expand(state, pins) for state in states]
+        self.reports = [MCP2221A.gpioPacket(state) for state in self.states]
+        self.delays = list(delays) if delays is not None else [period]*len(self.reports)
+        if len(self.delays) != len(self.reports):
+            raise ValueError("One delay per step")
+
+    @staticmethod
+    def expand(state, pins):
+        if isinstance(state, int):
+            return [(state >> pin) & 1 if pins & (1 << pin) else None for pin in range(4)]
+        if len(state) != 4:
+            raise ValueError("State has 4 pins")
+        return list(state)
+
+    def __len__(self):
+        return len(self.reports)
+
+    def player(self, mcp2221a, loops=1, spin=0.0005, pipelineDepth=1):
+        # pipelineDepth - reports in flight, only used when all delays are 0
+        # Pins written by the sequence end in a state the GP shadow does not know, so it is dropped
+        mcp2221a.invalidateGpShadow()
+        return reportPlayer.reportPlayer(mcp2221a, self.reports, delays=self.delays, loops=loops, spin=spin,
+                                         pipelineDepth=pipelineDepth)
+
+    def play(self, mcp2221a, loops=1, spin=0.0005, pipelineDepth=1):
+        # Start playback in background thread, returns the player (stop(), stats())
+        player = self.player(mcp2221a, loops, spin, pipelineDepth)
+        player.start()
+        return player
+
+    def run(self, mcp2221a, loops=1, spin=0.0005, pipelineDepth=1):
+        # Blocking playback, returns player stats
+        player = self.player(mcp2221a, loops, spin, pipelineDepth)
+        stats = player.play()
+        if player.error is not None:
+            raise player.error
+        return stats
+
+def clock(pin, cycles=1, period=0):
+    # Square wave on GPx, period - seconds per half cycle
+    return gpioSequence([1 << pin, 0]*cycles, period, pins=1 << pin)
+
+def shiftOut(data, dataPin, clockPin, bits=8, msbFirst=True, period=0):
+    # Bit-banged serial output of bytes data: data bit set up with clock low, then clock high
+    states = []
+    for byte in data:
+        for i in range(bits):
+            bit = (byte >> (bits - 1 - i if msbFirst else i)) & 1
+            states.append((bit << dataPin))
+            states.append((bit << dataPin) | (1 << clockPin))
+    states.append(0)
+    return gpioSequence(states, period, pins=(1 << dataPin) | (1 << clockPin))
@@ -0,0 +1,97 @@
+# Interrupt-on-change events of GP1
+# The chip latches enabled GP1 edges in an interrupt flag (status reply byte 24). The monitor polls only the status
+# report and clears the flag (one SET_SRAM_SETTINGS report) when it was set, so counting pulses costs one
+# transaction per poll interval instead of sampling GP1 with readGP() at twice the pulse rate.
+# The chip has a flag, not a counter: several edges between two polls count as one event, so the poll period
+# must be shorter than the shortest pulse spacing for exact counts.
+# While running the monitor owns the device, do not use the mcp2221a object from other threads.
+#
+# Usage:
+#     monitor = interruptMonitor.interruptMonitor(mcp2221a, period=0.001, positive=True)
+#     monitor.onInterrupt(lambda t, count: print(t, count))
+#     monitor.start()
+#     ...
+#     async for t, count in monitor.events():
+#         ...
+import MCP2221A
+import sampler
+import asyncio
+import collections
+import threading
+import time
+
+class interruptMonitor(sampler.pollingSampler):
+
+    def __init__(self, mcp2221a, period=0.001, positive=True, negative=False, maxEvents=10000):
+        # period             - seconds between polls (0 - as fast as USB allows)
+        # positive, negative - edges of GP1 that set the interrupt flag
+        # maxEvents          - number of event timestamps kept
+        sampler.pollingSampler.__init__(self, mcp2221a, MCP2221A.STATUS_COMMAND, period)
+        self.positive = positive
+        self.negative = negative
+        self.count = 0  # Events (polls that found the flag set)
+        self.times = collections.deque(maxlen=maxEvents)
+        self.callbacks = []
+        self.condition = threading.Condition()
+
+    def enable(self):
+        # GP1 as interrupt detection input with the selected edges, flag cleared, in one SRAM transaction
+        config = MCP2221A.sramConfig().interruptPin().interrupt(self.positive, self.negative).clearInterruptFlag()
+        self.mcp2221a.configureSram(config)
+
+    def start(self):
+        self.enable()
+        sampler.pollingSampler.start(self)
+
+    def onInterrupt(self, callback):
+        # callback(timestamp, count) is called from the monitor thread for every event
+        self.callbacks.append(callback)
+
+    def removeCallback(self, callback):
+        self.callbacks.remove(callback)
+
+    def process(self, t, info):
+        if not info[24]:
+            return
+        self.mcp2221a.transfer(MCP2221A.CLEAR_INTERRUPT_COMMAND)
+        with self.condition:
+            self.count += 1
+            self.times.append(t)
+            count = self.count
+            self.condition.notify_all()
+        for callback in self.callbacks:
+            callback(t, count)
+
+    def wait(self, timeout=None):
+        # Block until the next event, returns its timestamp or None on timeout
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.condition:
+            seen = self.count
+            while self.count == seen:
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.times[-1]
+
+    async def events(self):
+        # Async iterator of (timestamp, count), for the event loop it is iterated in
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def callback(t, count):
+            loop.call_soon_threadsafe(queue.put_nowait, (t, count))
+
+        self.onInterrupt(callback)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.removeCallback(callback)
+
+    def stats(self):
+        stats = sampler.pollingSampler.stats(self)
+        elapsed = stats['elapsed']
+        stats['events'] = self.count
+        stats['eventRate'] = self.count / elapsed if elapsed > 0 else 0
+        return stats
@@ -0,0 +1,231 @@
+# Per-command latency metrics of the HID exchange
+# Enabled per device with mcp2221a.enableMetrics(), which wraps the device transport in metricsTransport.
+# Disabled devices use their transport directly, so there is no overhead at all.
+import collections
+import json
+import threading
+import time
+
+CMD_RESET = 0x70  # Reset has no reply
+
+COMMAND_NAMES = {
+    0x10: 'STATUS_SET_PARAMETERS',
+    0x40: 'I2C_GET_DATA',
+    0x50: 'SET_GPIO_OUTPUT_VALUES',
+    0x51: 'GET_GPIO_VALUES',
+    0x60: 'SET_SRAM_SETTINGS',
+    0x61: 'GET_SRAM_SETTINGS',
+    0x70: 'RESET',
+    0x90: 'I2C_WRITE_DATA',
+    0x91: 'I2C_READ_DATA',
+    0x92: 'I2C_WRITE_DATA_REPEATED_START',
+    0x93: 'I2C_READ_DATA_REPEATED_START',
+    0x94: 'I2C_WRITE_DATA_NO_STOP',
+    0xB0: 'READ_FLASH',
+    0xB1: 'WRITE_FLASH',
+}
+
+HISTOGRAM_BUCKETS = 32  # Bucket x counts latencies below 2**x microseconds (and at least 2**(x-1))
+
+def isErrorReply(cmd, reply):
+    # Reply reporting that the command failed
+    if reply[0] != cmd:
+        return True
+    if cmd == 0x50 or cmd == 0x51:
+        return 0xEE in reply[2:18]  # GPx not set for GPIO operation
+    if cmd == 0xB0 or cmd == 0xB1 or cmd == 0x60:
+        return reply[1] != 0x00  # FlashError / SRAM settings not accepted
+    return False
+
+class commandStats(object):
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'timeouts', 'errors', 'errorReplies', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.timeouts = 0
+        self.errors = 0        # Exceptions other than timeouts
+        self.errorReplies = 0  # Replies reporting failure (0xEE, flash errors, ...)
+        self.histogram = [0]*HISTOGRAM_BUCKETS
+
+    def percentile(self, p):
+        # Upper bound of the histogram bucket holding the p-th percentile [s]
+        target = self.count * p / 100.0
+        seen = 0
+        for bucket, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= target:
+                return (1 << bucket) * 1e-6
+        return 0.0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.minimum or 0.0,
+            'max': self.maximum,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'errorReplies': self.errorReplies,
+            'histogram': list(self.histogram),
+        }
+
+class commandMetrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = collections.defaultdict(commandStats)
+        self.hooks = []
+        self.startTime = time.time()
+        self.unmatchedReplies = 0  # Replies no request was waiting for (late replies of timed out requests)
+
+    def addHook(self, hook):
+        # hook(cmd, start, end, reply, exception) after every transaction (e.g. for a profiler or tracer)
+        # reply is only valid during the call, exception is None if the transaction succeeded
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, cmd, start, end, reply=None, exception=None):
+        latency = end - start
+        with self.lock:
+            stats = self.commands[cmd]
+            stats.count += 1
+            stats.total += latency
+            if stats.minimum is None or latency < stats.minimum:
+                stats.minimum = latency
+            if latency > stats.maximum:
+                stats.maximum = latency
+            stats.histogram[min(HISTOGRAM_BUCKETS - 1, int(latency * 1e6).bit_length())] += 1
+            if exception is not None:
+                if isTimeout(exception):
+                    stats.timeouts += 1
+                else:
+                    stats.errors += 1
+            elif reply is not None and isErrorReply(cmd, reply):
+                stats.errorReplies += 1
+        for hook in self.hooks:
+            hook(cmd, start, end, reply, exception)
+
+    def recordUnmatched(self):
+        with self.lock:
+            self.unmatchedReplies += 1
+
+    def reset(self):
+        with self.lock:
+            self.commands.clear()
+            self.unmatchedReplies = 0
+            self.startTime = time.time()
+
+    def snapshot(self):
+        # dict: command name -> statistics (latencies in seconds)
+        with self.lock:
+            return dict((COMMAND_NAMES.get(cmd, '0x%02X' % cmd), stats.snapshot())
+                        for cmd, stats in sorted(self.commands.items()))
+
+    def exportJson(self, path=None):
+        data = json.dumps({'since': self.startTime, 'commands': self.snapshot(),
+                           'unmatchedReplies': self.unmatchedReplies}, indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(data)
+        return data
+
+    def report(self):
+        # Human readable table
+        lines = ["%-30s %8s %10s %10s %10s %8s %8s" % ('Command', 'Count', 'Mean [us]', 'p99 [us]', 'Max [us]',
+                                                       'Timeouts', 'Errors')]
+        for name, stats in self.snapshot().items():
+            lines.append("%-30s %8u %10.1f %10.1f %10.1f %8u %8u" % (
+                name, stats['count'], stats['mean']*1e6, stats['p99']*1e6, stats['max']*1e6, stats['timeouts'],
+                stats['errors'] + stats['errorReplies']))
+        if self.unmatchedReplies:
+            lines.append("Unmatched (late) replies: %u" % self.unmatchedReplies)
+        return '\n'.join(lines)
+
+def isTimeout(exception):
+    # pyusb raises usb.core.USBTimeoutError (errno 110/ETIMEDOUT)
+    return isinstance(exception, TimeoutError) or type(exception).__name__ == 'USBTimeoutError' or \
+        getattr(exception, 'errno', None) == 110
+
+class metricsTransport(object):
+    # Wraps a transport and records every write/read pair (pipelined writes are paired in order)
+
+    def __init__(self, transport, metrics):
+        self.transport = transport
+        self.metrics = metrics
+        self.pending = collections.deque()  # (cmd, write time) waiting for reply
+
+    def __getattr__(self, name):
+        # usbDevice, emulator attributes, ...
+        return getattr(self.transport, name)
+
+    def write(self, buf):
+        start = time.perf_counter()
+        try:
+            self.transport.write(buf)
+        except Exception as e:
+            self.metrics.record(buf[0], start, time.perf_counter(), exception=e)
+            raise
+        if buf[0] == CMD_RESET:
+            self.metrics.record(CMD_RESET, start, time.perf_counter())
+        else:
+            self.pending.append((buf[0], start))
+
+    def completed(self, reply, exception):
+        # A reply completes the oldest pending request with the same command byte, requests skipped on the way
+        # lost their replies (timeouts). Replies no request is waiting for are only counted (unmatchedReplies).
+        # A failed read completes the oldest pending request.
+        end = time.perf_counter()
+        if reply is None:
+            if self.pending:
+                cmd, start = self.pending.popleft()
+                self.metrics.record(cmd, start, end, None, exception)
+            return
+        if not any(cmd == reply[0] for cmd, start in self.pending):
+            self.metrics.recordUnmatched()
+            return
+        while True:
+            cmd, start = self.pending.popleft()
+            if cmd == reply[0]:
+                self.metrics.record(cmd, start, end, reply, None)
+                return
+            self.metrics.record(cmd, start, end, None, TimeoutError('Reply lost'))
+
+    def read(self, timeout=None):
+        try:
+            reply = self.transport.read(timeout)
+        except Exception as e:
+            self.completed(None, e)
+            raise
+        self.completed(reply, None)
+        return reply
+
+    def readInto(self, buf, timeout=None):
+        try:
+            n = self.transport.readInto(buf, timeout)
+        except Exception as e:
+            self.completed(None, e)
+            raise
+        self.completed(buf, None)
+        return n
+
+    def tryReadInto(self, buf, timeout=None):
+        # No reply yet is not a timeout of the pending request
+        try:
+            n = self.transport.tryReadInto(buf, timeout)
+        except Exception as e:
+            if not isTimeout(e):
+                self.completed(None, e)
+            raise
+        self.completed(buf, None)
+        return n
+
+    def reconnect(self):
+        self.pending.clear()
+        return self.transport.reconnect()
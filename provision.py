@@ -0,0 +1,234 @@
+# Non-interactive provisioning of MCP2221A flash from a desired-state JSON file
+# Every chip's flash sections are read once, only sections that differ are written, written sections are read back
+# and verified. All attached chips are provisioned in parallel (deviceManager).
+#
+# Desired-state file (every key is optional, missing settings are left as they are):
+#     {
+#         "descriptors": {"Manufacturer": "ACME", "Product": "Rack controller", "Serial": "RC-{factorySerial}"},
+#         "gpSettings": [{"designation": 0, "direction": 0, "outputValue": 1}, null, 8, {"direction": 1}],
+#         "chipSettings": {"ledI2c": 1, "dacVref": 3, "dacVrm": 1, "requestedCurrent": 100}
+#     }
+# "Serial" may contain {factorySerial}, GP settings are per pin (dict of fields, raw byte or null).
+# Chip security is never changed.
+#
+# Usage:
+#     python3 provision.py state.json [--dry-run] [--serial 01234567 ...]
+import MCP2221A
+import deviceManager
+import argparse
+import json
+import sys
+
+SECTIONS = ('descriptors', 'gpSettings', 'chipSettings')
+DESCRIPTOR_MAX_LENGTH = 30  # Characters
+FACTORY_SERIAL_LENGTH = 8
+
+DESCRIPTORS = {
+    'Manufacturer': MCP2221A.READ_USB_MANUFACTURER_DESCRIPTOR_STRING,
+    'Product': MCP2221A.READ_USB_PRODUCT_DESCRIPTOR_STRING,
+    'Serial': MCP2221A.READ_USB_SERIAL_NUMBER_DESCRIPTOR_STRING,
+}
+
+# name: (bit offset, width) in one GP settings byte
+GP_SETTINGS_FIELDS = {
+    'designation': (0, 3),
+    'direction': (3, 1),
+    'outputValue': (4, 1),
+}
+
+# name: (byte, bit offset, width) in chip settings (READ_CHIP_SETTINGS reply bytes 4-13)
+CHIP_SETTINGS_FIELDS = {
+    'serialNumberEnumeration': (0, 7, 1),
+    'ledUartRx': (0, 6, 1),
+    'ledUartTx': (0, 5, 1),
+    'ledI2c': (0, 4, 1),
+    'sspnd': (0, 3, 1),
+    'usbcfg': (0, 2, 1),
+    'clockDutyCycle': (1, 3, 2),
+    'clockDivider': (1, 0, 3),
+    'dacVref': (2, 6, 2),
+    'dacVrm': (2, 5, 1),
+    'dacValue': (2, 0, 5),
+    'interruptPositiveEdge': (3, 6, 1),
+    'interruptNegativeEdge': (3, 5, 1),
+    'adcVref': (3, 3, 2),
+    'adcVrm': (3, 2, 1),
+    'vendorId': (4, 0, 16),
+    'productId': (6, 0, 16),
+    'powerAttributes': (8, 0, 8),
+    'requestedCurrent': (9, 0, 8),  # mA, stored in 2 mA units
+}
+
+def setBits(data, byte, shift, width, value):
+    # Set bit field of data (little endian, may span several bytes)
+    mask = (1 << width) - 1
+    if not 0 <= value <= mask:
+        raise ValueError("Value %r does not fit in %u bits" % (value, width))
+    size = (shift + width + 7)//8
+    current = int.from_bytes(data[byte:byte + size], 'little')
+    current = (current & ~(mask << shift)) | (value << shift)
+    data[byte:byte + size] = current.to_bytes(size, 'little')
+
+def checkField(where, value, width, scale=1):
+    # ValueError naming the field when value is not an integer fitting in width bits (value // scale is stored)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("%s: %r is not an integer" % (where, value))
+    if not 0 <= value // scale < (1 << width):
+        raise ValueError("%s: %r out of range (0-%u)" % (where, value, ((1 << width) - 1)*scale + scale - 1))
+
+def validate(desired):
+    # Check the whole desired-state file before any chip is touched, ValueError names the offending field
+    if not isinstance(desired, dict):
+        raise ValueError("Desired state is not a JSON object")
+    for section in desired:
+        if section not in SECTIONS:
+            raise ValueError("Unknown section %r (expected %s)" % (section, ', '.join(SECTIONS)))
+    descriptors = desired.get('descriptors') or {}
+    if not isinstance(descriptors, dict):
+        raise ValueError("descriptors: not a JSON object")
+    for name, value in descriptors.items():
+        if name not in DESCRIPTORS:
+            raise ValueError("descriptors: unknown descriptor %r (expected %s)" % (name, ', '.join(DESCRIPTORS)))
+        if not isinstance(value, str):
+            raise ValueError("descriptors.%s: %r is not a string" % (name, value))
+        try:
+            length = len(value.format(factorySerial='0'*FACTORY_SERIAL_LENGTH))
+        except (KeyError, IndexError, ValueError):
+            raise ValueError("descriptors.%s: only {factorySerial} can be substituted" % name)
+        if length > DESCRIPTOR_MAX_LENGTH:
+            raise ValueError("descriptors.%s: longer than %u characters" % (name, DESCRIPTOR_MAX_LENGTH))
+    gpSettings = desired.get('gpSettings') or []
+    if not isinstance(gpSettings, list) or len(gpSettings) > 4:
+        raise ValueError("gpSettings: not a list of at most 4 pins")
+    for pin, setting in enumerate(gpSettings):
+        if setting is None:
+            continue
+        if isinstance(setting, dict):
+            for name, value in setting.items():
+                if name not in GP_SETTINGS_FIELDS:
+                    raise ValueError("gpSettings[%u]: unknown field %r (expected %s)" % (
+                        pin, name, ', '.join(GP_SETTINGS_FIELDS)))
+                checkField("gpSettings[%u].%s" % (pin, name), value, GP_SETTINGS_FIELDS[name][1])
+        else:
+            checkField("gpSettings[%u]" % pin, setting, 8)
+    chipSettings = desired.get('chipSettings') or {}
+    if not isinstance(chipSettings, dict):
+        raise ValueError("chipSettings: not a JSON object")
+    for name, value in chipSettings.items():
+        if name not in CHIP_SETTINGS_FIELDS:
+            raise ValueError("chipSettings: unknown field %r" % name)
+        checkField("chipSettings.%s" % name, value, CHIP_SETTINGS_FIELDS[name][2],
+                   2 if name == 'requestedCurrent' else 1)
+
+def desiredGpSettings(current, desired):
+    # current - 4 GP settings bytes from flash, returns desired 4 bytes
+    data = bytearray(current)
+    for pin, setting in enumerate(desired or []):
+        if setting is None:
+            continue
+        if isinstance(setting, int):
+            data[pin] = setting
+            continue
+        for name, value in setting.items():
+            shift, width = GP_SETTINGS_FIELDS[name]
+            setBits(data, pin, shift, width, int(value))
+    return bytes(data)
+
+def desiredChipSettings(current, desired):
+    # current - 10 chip settings bytes from flash, returns desired 10 bytes
+    data = bytearray(current)
+    for name, value in (desired or {}).items():
+        byte, shift, width = CHIP_SETTINGS_FIELDS[name]
+        value = int(value)
+        if name == 'requestedCurrent':
+            value //= 2
+        setBits(data, byte, shift, width, value)
+    # Chip security bits are kept
+    data[0] = (data[0] & ~MCP2221A.CHIP_SECURITY_MASK) | (current[0] & MCP2221A.CHIP_SECURITY_MASK)
+    return bytes(data)
+
+def readState(mcp2221a):
+    # Current flash contents: section -> comparable value
+    mcp2221a.invalidateFlashCache()
+    state = dict((name, mcp2221a.readDescriptorString(section)) for name, section in DESCRIPTORS.items())
+    state['gpSettings'] = mcp2221a.readFlash(MCP2221A.READ_GP_SETTINGS)[4:8]
+    state['chipSettings'] = mcp2221a.readFlash(MCP2221A.READ_CHIP_SETTINGS)[4:4 + MCP2221A.CHIP_SETTINGS_SIZE]
+    return state
+
+def plan(mcp2221a, desired, current=None):
+    # Sections that differ from desired state: section -> desired value
+    if current is None:
+        current = readState(mcp2221a)
+    changes = dict()
+    descriptors = desired.get('descriptors') or {}
+    for name in DESCRIPTORS:
+        if name in descriptors:
+            value = descriptors[name]
+            if '{factorySerial}' in value:
+                value = value.format(factorySerial=mcp2221a.readChipFactorySerialNumber())
+            if value != current[name]:
+                changes[name] = value
+    if desired.get('gpSettings'):
+        value = desiredGpSettings(current['gpSettings'], desired['gpSettings'])
+        if value != current['gpSettings']:
+            changes['gpSettings'] = value
+    if desired.get('chipSettings'):
+        value = desiredChipSettings(current['chipSettings'], desired['chipSettings'])
+        if value != current['chipSettings']:
+            changes['chipSettings'] = value
+    return changes
+
+def provisionChip(mcp2221a, desired, verify=True, dryRun=False):
+    # Returns list of written (or, with dryRun, differing) sections
+    changes = plan(mcp2221a, desired)
+    if dryRun:
+        return sorted(changes)
+    for name, value in changes.items():
+        if name in DESCRIPTORS:
+            mcp2221a.writeDescriptor(value, name)
+        elif name == 'gpSettings':
+            mcp2221a.writeFlashGpSettings(MCP2221A.gpSettings_U.from_buffer_copy(value))
+        elif name == 'chipSettings':
+            mcp2221a.writeFlashChipSettings(value)
+    if verify and changes:
+        written = readState(mcp2221a)
+        for name, value in changes.items():
+            if written[name] != value:
+                raise MCP2221A.FlashError('Verification of %s failed' % name)
+    return sorted(changes)
+
+def provisionAll(manager, desired, serials=None, verify=True, dryRun=False):
+    # Every chip (or chips in serials) in parallel, returns list of deviceResult (deviceManager.runAll())
+    # The desired state is validated first, an invalid file raises ValueError before any chip is touched
+    validate(desired)
+    return manager.runAll(lambda mcp2221a: provisionChip(mcp2221a, desired, verify, dryRun), serials)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Provision MCP2221A flash settings from a desired-state file')
+    parser.add_argument('state', help='desired-state JSON file')
+    parser.add_argument('--serial', action='append', help='only this chip (factory or USB serial), can be repeated')
+    parser.add_argument('--dry-run', action='store_true', help='only report sections that differ')
+    parser.add_argument('--no-verify', action='store_true', help='do not read written sections back')
+    args = parser.parse_args()
+
+    with open(args.state) as f:
+        desired = json.load(f)
+    try:
+        validate(desired)
+    except ValueError as e:
+        sys.exit("%s: %s" % (args.state, e))
+
+    manager = deviceManager.deviceManager()
+    results = provisionAll(manager, desired, args.serial, not args.no_verify, args.dry_run)
+    manager.close()
+
+    failed = 0
+    for i, result in enumerate(results):
+        serial = result.serial if result.serial is not None else 'device%u' % i
+        if result.error is not None:
+            failed += 1
+            print("%-12s FAILED %s" % (serial, result.error))
+        else:
+            print("%-12s %-9s %s (%.3f s)" % (serial, 'differs' if args.dry_run else 'written',
+                                              ', '.join(result.value) or '-', result.elapsed))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,207 @@
+# Table-driven decoding of MCP2221A replies
+# A report layout is a list of field() specs. compiledDecoder turns it into one struct.Struct that unpacks every
+# used byte/word of the report in a single call, plus generated code that extracts bit fields, enums etc.
+# decodeBatch() decodes many captured 64 byte reports at once into a NumPy structured array.
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class field(object):
+    __slots__ = ('name', 'offset', 'fmt', 'shift', 'mask', 'scale', 'enum', 'isBool', 'hexDigits', 'isText')
+
+    def __init__(self, name, offset, fmt='B', shift=0, mask=None, scale=1, enum=None, isBool=False, hexDigits=0,
+                 isText=False):
+        # offset    - byte offset in the report
+        # fmt       - struct format of the value at offset ('B', 'H' (little endian), '2s', ...)
+        # shift     - bit field: value >> shift
+        # mask      - bit field: & mask (after shift)
+        # scale     - multiplier
+        # enum      - dict mapping value to name
+        # isBool    - value as bool
+        # hexDigits - value as lowercase hex string with this many digits
+        # isText    - bytes value ('Ns' fmt) decoded as latin-1 string
+        self.name = name
+        self.offset = offset
+        self.fmt = fmt
+        self.shift = shift
+        self.mask = mask
+        self.scale = scale
+        self.enum = enum
+        self.isBool = isBool
+        self.hexDigits = hexDigits
+        self.isText = isText
+
+def bit(name, offset, bitNumber):
+    return field(name, offset, shift=bitNumber, mask=1, isBool=True)
+
+def bits(name, offset, low, width, enum=None):
+    return field(name, offset, shift=low, mask=(1 << width) - 1, enum=enum)
+
+class compiledDecoder(object):
+
+    def __init__(self, spec):
+        self.spec = list(spec)
+        # Unique (offset, fmt) slots, several bit fields usually share one byte
+        slots = sorted(set((f.offset, f.fmt) for f in self.spec))
+        self.slots = slots
+        slotIndex = dict((slot, i) for i, slot in enumerate(slots))
+
+        fmt = '<'
+        position = 0
+        for offset, slotFmt in slots:
+            if offset < position:
+                raise ValueError("Overlapping fields at offset %u" % offset)
+            if offset > position:
+                fmt += '%ux' % (offset - position)
+            fmt += slotFmt
+            position = offset + struct.calcsize('<' + slotFmt)
+        self.struct = struct.Struct(fmt)
+        self.size = position
+
+        # Generated decode function: one unpack_from() and a dict display
+        enums = []
+        items = []
+        for f in self.spec:
+            expression = 'v[%u]' % slotIndex[(f.offset, f.fmt)]
+            if f.shift:
+                expression = '(%s >> %u)' % (expression, f.shift)
+            if f.mask is not None:
+                expression = '(%s & %u)' % (expression, f.mask)
+            if f.scale != 1:
+                expression = '%s * %r' % (expression, f.scale)
+            if f.enum is not None:
+                enums.append(f.enum)
+                expression = 'enums[%u][%s]' % (len(enums) - 1, expression)
+            elif f.isBool:
+                expression = 'bool(%s)' % expression
+            elif f.hexDigits:
+                expression = "'%%0%ux' %% (%s)" % (f.hexDigits, expression)
+            elif f.isText:
+                expression = "%s.decode('latin-1')" % expression
+            items.append('        %r: %s,' % (f.name, expression))
+        source = 'def decode(data, offset=0):\n    v = unpack_from(data, offset)\n    return {\n%s\n    }\n' % \
+                 '\n'.join(items)
+        namespace = {'unpack_from': self.struct.unpack_from, 'enums': enums}
+        exec(compile(source, '<reportDecoder>', 'exec'), namespace)
+        self.decode = namespace['decode']
+
+    def names(self):
+        return [f.name for f in self.spec]
+
+    def dtype(self):
+        # NumPy dtype of decodeBatch() result, enums are kept as their numeric code
+        fields = []
+        for f in self.spec:
+            if f.isText:
+                fields.append((f.name, 'S%u' % struct.calcsize(f.fmt)))
+            elif f.isBool:
+                fields.append((f.name, numpy.bool_))
+            elif f.scale != 1 and isinstance(f.scale, float):
+                fields.append((f.name, numpy.float64))
+            else:
+                fields.append((f.name, numpy.uint32))
+        return numpy.dtype(fields)
+
+    def decodeBatch(self, reports, reportSize=64):
+        # reports - bytes/bytearray/memoryview of N concatenated reports or NumPy uint8 array of shape (N, reportSize)
+        # Returns NumPy structured array with one record per report
+        if numpy is None:
+            raise ValueError('NumPy is not installed')
+        raw = numpy.frombuffer(memoryview(reports).cast('B'), dtype=numpy.uint8)
+        if raw.size % reportSize != 0:
+            raise ValueError("Data is not a whole number of reports")
+        slotDtype = numpy.dtype({
+            'names': ['s%u' % i for i in range(len(self.slots))],
+            'formats': [numpy.dtype('<' + ('u1' if fmt == 'B' else 'u2' if fmt == 'H' else 'u4' if fmt == 'I' else
+                                           'S%u' % struct.calcsize(fmt))) for offset, fmt in self.slots],
+            'offsets': [offset for offset, fmt in self.slots],
+            'itemsize': reportSize,
+        })
+        records = raw.view(slotDtype)
+        output = numpy.empty(len(records), dtype=self.dtype())
+        for f in self.spec:
+            values = records['s%u' % self.slots.index((f.offset, f.fmt))]
+            if not f.isText:
+                values = values.astype(numpy.uint32)
+                if f.shift:
+                    values = values >> f.shift
+                if f.mask is not None:
+                    values = values & f.mask
+                if f.scale != 1:
+                    values = values * f.scale
+            output[f.name] = values
+        return output
+
+def gpSettingsSpec(offset, prefix=''):
+    spec = []
+    for pin in range(4):
+        name = '%sGP%u ' % (prefix, pin)
+        spec += [
+            bits(name + 'designation', offset + pin, 0, 3),
+            bits(name + 'direction', offset + pin, 3, 1),
+            bits(name + 'output value', offset + pin, 4, 1),
+        ]
+    return spec
+
+CHIP_SECURITY = {0: 'Unsecured', 1: 'Password-protected', 2: 'Permanently-locked', 3: 'Permanently-locked'}
+VREF_LEVEL = {0: 'Off', 1: '1.024V', 2: '2.048V', 3: '4.096V'}
+
+def chipSettingsSpec(offset=4):
+    # Chip settings layout, same in READ_CHIP_SETTINGS (flash) and GET_SRAM_SETTINGS replies
+    return [
+        bit('Provide serial number on enumeration', offset, 7),
+        bit('LED UART RX', offset, 6),
+        bit('LED UART TX', offset, 5),
+        bit('LED I2C', offset, 4),
+        bit('SSPND', offset, 3),
+        bit('USBCFG', offset, 2),
+        bits('Chip security', offset, 0, 2, CHIP_SECURITY),
+        bits('Clock output duty cycle', offset + 1, 3, 2),
+        bits('Clock output divider', offset + 1, 0, 3),
+        bits('DAC reference voltage', offset + 2, 6, 2, VREF_LEVEL),
+        bit('DAC reference is VRM', offset + 2, 5),
+        bits('DAC power-up value', offset + 2, 0, 5),
+        bit('Interrupt on positive edge', offset + 3, 6),
+        bit('Interrupt on negative edge', offset + 3, 5),
+        bits('ADC reference voltage', offset + 3, 3, 2, VREF_LEVEL),
+        bit('ADC reference is VRM', offset + 3, 2),
+        field('USB vendorID', offset + 4, 'H', hexDigits=4),
+        field('USB productID', offset + 6, 'H', hexDigits=4),
+        field('USB power attributes', offset + 8),
+        field('USB requested number of mA', offset + 9, scale=2),
+    ]
+
+STATUS_SPEC = [
+    field('Cancel I2C transfer', 2),
+    field('Set I2C speed', 3),
+    field('I2C speed divider requested', 4),
+    field('I2C state', 8),
+    field('I2C requested length', 9, 'H'),
+    field('I2C transferred length', 11, 'H'),
+    field('I2C buffer counter', 13),
+    field('I2C speed divider', 14),
+    field('I2C timeout', 15),
+    field('I2C address', 16, 'H'),
+    bit('I2C address NACK', 20, 6),
+    field('SCL', 22),
+    field('SDA', 23),
+    field('Interrupt edge detected', 24),
+    field('I2C read pending', 25),
+    field('MCP2221A HW revision', 46, '2s', isText=True),
+    field('MCP2221A Firmware revision', 48, '2s', isText=True),
+    field('ADC channel 1', 50, 'H'),
+    field('ADC channel 2', 52, 'H'),
+    field('ADC channel 3', 54, 'H'),
+]
+
+CHIP_SETTINGS_SPEC = chipSettingsSpec(4)
+GP_SETTINGS_SPEC = gpSettingsSpec(4)
+SRAM_SETTINGS_SPEC = chipSettingsSpec(4) + gpSettingsSpec(22)
+
+STATUS_DECODER = compiledDecoder(STATUS_SPEC)
+CHIP_SETTINGS_DECODER = compiledDecoder(CHIP_SETTINGS_SPEC)
+GP_SETTINGS_DECODER = compiledDecoder(GP_SETTINGS_SPEC)
+SRAM_SETTINGS_DECODER = compiledDecoder(SRAM_SETTINGS_SPEC)
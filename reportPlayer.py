@@ -0,0 +1,164 @@
+# Paced playback of precomputed reports
+# A thread sends a list of ready-to-send reports, report i at startTime + (sum of previous step times).
+# Deadlines are absolute (monotonic clock), so a late step does not shift the following ones (no drift).
+# While playing the player owns the device, do not use the mcp2221a object from other threads.
+# Back-to-back playback (all step times 0) can be pipelined: pipelineDepth reports are written before the oldest
+# reply is read, so USB round trips overlap.
+import metrics
+import collections
+import threading
+import time
+
+isErrorReply = metrics.isErrorReply
+
+class reportPlayer(threading.Thread):
+
+    def __init__(self, mcp2221a, reports, period=0, delays=None, loops=1, spin=0.0005, pipelineDepth=1):
+        # reports - list of 64 byte reports (array/bytes), sent as they are
+        # period  - seconds between reports (0 - back-to-back)
+        # delays  - seconds after every report (overrides period), same length as reports
+        # loops   - times the whole list is played, 0 - until stop()
+        # spin    - last part of every wait is busy-waited instead of sleeping (better timing, more CPU)
+        # pipelineDepth - reports in flight during back-to-back playback (1 - wait for every reply)
+        threading.Thread.__init__(self, daemon=True)
+        self.mcp2221a = mcp2221a
+        self.reports = reports
+        self.delays = list(delays) if delays is not None else [period]*len(reports)
+        if len(self.delays) != len(self.reports):
+            raise ValueError("One delay per report")
+        self.loops = loops
+        self.spin = spin
+        self.pipelineDepth = max(1, pipelineDepth)
+        self.running = threading.Event()
+        self.error = None
+
+        self.steps = 0        # Reports sent
+        self.errors = 0       # Replies reporting failure
+        self.late = 0         # Reports sent more than one step time after their deadline
+        self.startTime = 0
+        self.stopTime = 0
+        self.jitterSum = 0    # Sum of (send time - deadline)
+        self.jitterSqSum = 0
+        self.jitterMax = 0
+
+    def start(self):
+        self.running.set()
+        threading.Thread.start(self)
+
+    def stop(self):
+        self.running.clear()
+        if self.is_alive():
+            self.join()
+
+    def play(self):
+        # Blocking playback in the calling thread
+        self.running.set()
+        self.run()
+        return self.stats()
+
+    def run(self):
+        if self.pipelineDepth > 1 and not any(self.delays):
+            return self.runPipelined()
+        transfer = self.mcp2221a.transfer
+        clock = time.perf_counter
+        sleep = time.sleep
+        spin = self.spin
+        reports = self.reports
+        delays = self.delays
+        count = len(reports)
+
+        deadline = self.startTime = clock()
+        loop = 0
+        try:
+            while self.running.is_set() and count and (self.loops == 0 or loop < self.loops):
+                for i in range(count):
+                    if not self.running.is_set():
+                        break
+                    now = clock()
+                    wait = deadline - now
+                    if wait > spin:
+                        sleep(wait - spin)
+                    while clock() < deadline:
+                        pass
+                    sent = clock()
+                    info = transfer(reports[i])
+                    if isErrorReply(reports[i][0], info):
+                        self.errors += 1
+
+                    error = sent - deadline
+                    self.steps += 1
+                    self.jitterSum += error
+                    self.jitterSqSum += error*error
+                    if error > self.jitterMax:
+                        self.jitterMax = error
+                    if delays[i] and error > delays[i]:
+                        self.late += 1
+                    deadline += delays[i]
+                    if not delays[i]:
+                        deadline = clock()  # Back-to-back
+                loop += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stopTime = clock()
+            self.running.clear()
+
+    def runPipelined(self):
+        # Back-to-back, no deadlines: jitter stays 0
+        # Replies are read with the device reply timeout (stale replies discarded, ReplyTimeoutError/
+        # UnexpectedReplyError stop playback). Reports are not retried, a late resend would reorder the sequence.
+        transport = self.mcp2221a.transport
+        readReply = self.mcp2221a.readReply
+        timeout = self.mcp2221a.timeout
+        clock = time.perf_counter
+        reports = self.reports
+        count = len(reports)
+        depth = self.pipelineDepth
+        inflight = collections.deque()
+
+        self.startTime = clock()
+        loop = 0
+        try:
+            while self.running.is_set() and count and (self.loops == 0 or loop < self.loops):
+                for i in range(count):
+                    if not self.running.is_set():
+                        break
+                    if len(inflight) >= depth:
+                        cmd = inflight.popleft()
+                        if isErrorReply(cmd, readReply(cmd, timeout)):
+                            self.errors += 1
+                    transport.write(reports[i])
+                    inflight.append(reports[i][0])
+                    self.steps += 1
+                loop += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                while inflight:
+                    cmd = inflight.popleft()
+                    if isErrorReply(cmd, readReply(cmd, timeout)):
+                        self.errors += 1
+            except Exception as e:
+                self.error = self.error or e
+            self.stopTime = clock()
+            self.running.clear()
+
+    def stats(self):
+        if self.running.is_set():
+            elapsed = time.perf_counter() - self.startTime
+        else:
+            elapsed = self.stopTime - self.startTime
+        steps = self.steps
+        mean = self.jitterSum / steps if steps else 0
+        variance = self.jitterSqSum / steps - mean*mean if steps else 0
+        return {
+            'steps': steps,
+            'elapsed': elapsed,
+            'stepRate': steps / elapsed if elapsed > 0 else 0,
+            'jitterMean': mean,                      # Average delay of a report after its deadline [s]
+            'jitterStd': max(0, variance) ** 0.5,
+            'jitterMax': self.jitterMax,
+            'late': self.late,
+            'errors': self.errors,
+        }
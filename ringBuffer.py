@@ -0,0 +1,98 @@
+# Fixed-size ring buffer of timestamped samples
+# Memory is allocated once, the oldest samples are overwritten when the buffer is full
+import array
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class ringBuffer(object):
+
+    def __init__(self, size, channels=1, typecode='B', useNumpy=False):
+        # size     - number of samples kept
+        # channels - values per sample
+        # typecode - array typecode of the values ('B' - uint8, 'H' - uint16, 'f' - float, ...)
+        # useNumpy - store samples in NumPy arrays (snapshot() then returns NumPy arrays too)
+        if useNumpy and numpy is None:
+            raise ValueError('NumPy is not installed')
+        self.size = size
+        self.channels = channels
+        self.useNumpy = useNumpy
+        if useNumpy:
+            self.times = numpy.zeros(size, dtype=numpy.float64)
+            self.data = numpy.zeros((size, channels), dtype=numpy.dtype(typecode))
+        else:
+            self.times = array.array('d', bytes(8*size))
+            self.data = array.array(typecode, [0]*(size*channels))
+        self.head = 0   # Index where the next sample is written
+        self.count = 0  # Number of samples ever written
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def nbytes(self):
+        # Memory used by the samples
+        if self.useNumpy:
+            return self.times.nbytes + self.data.nbytes
+        return len(self.times)*self.times.itemsize + len(self.data)*self.data.itemsize
+
+    def overwritten(self):
+        # Number of samples lost because the buffer was full
+        return max(0, self.count - self.size)
+
+    def append(self, t, value):
+        # Single channel sample
+        with self.lock:
+            i = self.head
+            self.times[i] = t
+            if self.useNumpy:
+                self.data[i, 0] = value
+            else:
+                self.data[i] = value
+            self.head = 0 if i + 1 == self.size else i + 1
+            self.count += 1
+
+    def appendRow(self, t, values):
+        # Multi channel sample, len(values) == channels
+        with self.lock:
+            i = self.head
+            self.times[i] = t
+            if self.useNumpy:
+                self.data[i] = values
+            else:
+                self.data[i*self.channels:(i + 1)*self.channels] = array.array(self.data.typecode, values)
+            self.head = 0 if i + 1 == self.size else i + 1
+            self.count += 1
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.count = 0
+
+    def last(self):
+        # (timestamp, values) of the newest sample, None if empty
+        with self.lock:
+            if self.count == 0:
+                return None
+            i = self.head - 1 if self.head else self.size - 1
+            if self.useNumpy:
+                return self.times[i], self.data[i].tolist()
+            return self.times[i], self.data[i*self.channels:(i + 1)*self.channels].tolist()
+
+    def snapshot(self):
+        # Copy of (timestamps, values) ordered from oldest to newest
+        # values is a flat array (channels values per sample) or a NumPy array of shape (n, channels)
+        with self.lock:
+            n = len(self)
+            start = (self.head - n) % self.size
+            if self.useNumpy:
+                index = (numpy.arange(n) + start) % self.size
+                return self.times[index], self.data[index]
+            if start + n <= self.size:
+                return (self.times[start:start + n],
+                        self.data[start*self.channels:(start + n)*self.channels])
+            return (self.times[start:] + self.times[:self.head],
+                    self.data[start*self.channels:] + self.data[:self.head*self.channels])
@@ -0,0 +1,92 @@
+# Base of background samplers: polls one command back-to-back (or with a fixed period) from its own thread
+# Subclasses set self.command and implement process(t, info).
+# While running the sampler owns the device, do not use the mcp2221a object from other threads.
+import threading
+import time
+
+class pollingSampler(threading.Thread):
+
+    def __init__(self, mcp2221a, command, period=0):
+        # command - report sent every sample
+        # period  - seconds between samples, 0 polls as fast as USB allows
+        threading.Thread.__init__(self, daemon=True)
+        self.mcp2221a = mcp2221a
+        self.command = command
+        self.period = period
+        # A gap longer than this counts as a missed interval
+        self.missedThreshold = 2*period if period else 0.004
+        self.running = threading.Event()
+        self.error = None
+
+        self.startTime = 0
+        self.stopTime = 0
+        self.polls = 0
+        self.missedIntervals = 0
+        self.maxGap = 0
+
+    def start(self):
+        self.running.set()
+        threading.Thread.start(self)
+
+    def stop(self):
+        self.running.clear()
+        if self.is_alive():
+            self.join()
+
+    def process(self, t, info):
+        # Called from the sampler thread with the reply to every poll
+        raise NotImplementedError
+
+    def run(self):
+        transfer = self.mcp2221a.transfer
+        command = self.command
+        process = self.process
+        clock = time.perf_counter
+        period = self.period
+        missedThreshold = self.missedThreshold
+
+        tPrev = self.startTime = clock()
+        nextTime = tPrev
+        try:
+            while self.running.is_set():
+                if period:
+                    nextTime += period
+                    delay = nextTime - clock()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        nextTime = clock()  # Late, do not try to catch up
+
+                info = transfer(command)
+                t = clock()
+                process(t, info)
+                self.polls += 1
+
+                gap = t - tPrev
+                if gap > missedThreshold:
+                    self.missedIntervals += 1
+                if gap > self.maxGap:
+                    self.maxGap = gap
+                tPrev = t
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stopTime = clock()
+            self.running.clear()
+
+    def elapsed(self):
+        if not self.startTime:
+            return 0
+        if self.running.is_set():
+            return time.perf_counter() - self.startTime
+        return self.stopTime - self.startTime
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return {
+            'polls': self.polls,
+            'elapsed': elapsed,
+            'pollRate': self.polls / elapsed if elapsed > 0 else 0,
+            'missedIntervals': self.missedIntervals,
+            'maxGap': self.maxGap,
+        }
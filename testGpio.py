@@ -1,5 +1,6 @@
 # Make sure you install pyusb and libusb on your system yo
 import MCP2221A
+import gpioSampler
 import time
 import customPrints
 
@@ -34,17 +35,35 @@ def testInput(mcp2221a):
         time.sleep(0.05)
         customPrints.cursorUpLines(4)
 
+def testInputSampler(mcp2221a):
+    # Edges are detected by the background sampler, terminal output does not slow down sampling
+    mcp2221a.setAllInput()
+
+    sampler = gpioSampler.gpioSampler(mcp2221a)
+    sampler.onEdge(lambda t, pin, value: customPrints.printf("%12.6f GP%u: %u\n", t - sampler.startTime, pin, value))
+    sampler.start()
+    try:
+        while sampler.is_alive():
+            time.sleep(1)
+    finally:
+        sampler.stop()
+        stats = sampler.stats()
+        customPrints.printf("%u samples, %.1f samples/s, %u missed intervals\n",
+                            stats['samples'], stats['sampleRate'], stats['missedIntervals'])
+
 if __name__ == '__main__':
     mcp2221a = MCP2221A.mcp2221a()
 
     print("*************************************************************")
     print("To finish gpio test press CTRL+C")
     print("*************************************************************")
-    testInputOutput = input("Test GPIO as output or input? (I/O): ").lower()
+    testInputOutput = input("Test GPIO as output, input or input edges (sampler)? (I/O/S): ").lower()
     print("*************************************************************")
     if testInputOutput == "o":
         testOutput(mcp2221a)
     elif testInputOutput == "i":
         testInput(mcp2221a)
+    elif testInputOutput == "s":
+        testInputSampler(mcp2221a)
     else:
         print("Wrong character: " + testInputOutput)
@@ -0,0 +1,147 @@
+# Cached index of attached USB devices
+# Enumeration only reads what libusb already has (device descriptor, bus, port path), string descriptors are
+# fetched lazily and only for devices that pass the numeric filters. The device list is cached and rebuilt when it
+# gets older than ttl seconds or, with the optional python-libusb1, as soon as a device is attached or detached.
+#
+# Usage:
+#     index = usbIndex.defaultIndex()
+#     for record in index.find(idVendor=0x4d8, idProduct=0xdd, serial='RC-01234567'):
+#         print(record.portPath, record.product)
+import threading
+import time
+import usb.core
+import usb.util
+
+try:
+    import usb1  # python-libusb1, optional: hotplug invalidation
+except ImportError:
+    usb1 = None
+
+DEFAULT_TTL = 1.0  # Seconds a cached device list is used without hotplug notification
+
+class usbRecord(object):
+    __slots__ = ('usbDevice', 'idVendor', 'idProduct', 'bus', 'address', 'portPath', '_strings')
+
+    def __init__(self, usbDevice):
+        self.usbDevice = usbDevice
+        self.idVendor = usbDevice.idVendor
+        self.idProduct = usbDevice.idProduct
+        self.bus = usbDevice.bus
+        self.address = usbDevice.address
+        # (bus, port, port, ...), None if the backend does not report port numbers
+        self.portPath = (usbDevice.bus,) + tuple(usbDevice.port_numbers) if usbDevice.port_numbers else None
+        self._strings = dict()
+
+    def string(self, name):
+        # String descriptor (iManufacturer, iProduct, iSerialNumber), read from the device once, '' if unavailable
+        if name not in self._strings:
+            value = ''
+            index = getattr(self.usbDevice, name)
+            if index:
+                try:
+                    value = usb.util.get_string(self.usbDevice, index) or ''
+                except (ValueError, usb.core.USBError):
+                    pass  # No permission or device gone
+            self._strings[name] = value
+        return self._strings[name]
+
+    @property
+    def manufacturer(self):
+        return self.string('iManufacturer')
+
+    @property
+    def product(self):
+        return self.string('iProduct')
+
+    @property
+    def serial(self):
+        # USB Serial Number Descriptor String (for MCP2221A only provided if enabled in chip settings)
+        return self.string('iSerialNumber')
+
+    def asDict(self):
+        return {
+            'idVendor': self.idVendor,
+            'idProduct': self.idProduct,
+            'bus': self.bus,
+            'address': self.address,
+            'portPath': self.portPath,
+            'manufacturer': self.manufacturer,
+            'product': self.product,
+            'serial': self.serial,
+        }
+
+    def __repr__(self):
+        return "usbRecord(%04x:%04x bus %u address %u port %s)" % (self.idVendor, self.idProduct, self.bus,
+                                                                    self.address, self.portPath)
+
+class usbIndex(object):
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        # ttl - seconds the device list is cached (None - until invalidate()/hotplug event)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = None
+        self.cacheTime = 0
+        self.context = None
+        if usb1 is not None:
+            context = usb1.USBContext()
+            if context.hasCapability(usb1.CAP_HAS_HOTPLUG):
+                context.hotplugRegisterCallback(self.hotplug, events=usb1.HOTPLUG_EVENT_DEVICE_ARRIVED |
+                                                usb1.HOTPLUG_EVENT_DEVICE_LEFT)
+                self.context = context
+            else:
+                context.close()
+
+    def hotplug(self, context, device, event):
+        self.cache = None
+        return False  # Stay registered
+
+    def invalidate(self):
+        self.cache = None
+
+    def records(self):
+        # All attached devices (cached)
+        with self.lock:
+            if self.context is not None:
+                self.context.handleEventsTimeout(tv=0)  # Deliver pending hotplug events
+            now = time.monotonic()
+            if self.cache is None or (self.ttl is not None and self.context is None and
+                                      now - self.cacheTime > self.ttl):
+                self.cache = [usbRecord(usbDevice) for usbDevice in usb.core.find(find_all=True)]
+                self.cacheTime = now
+            return self.cache
+
+    def find(self, idVendor=None, idProduct=None, portPath=None, serial=None, manufacturer=None, product=None):
+        # Records matching every given filter, string filters only read strings of devices passing the others
+        found = []
+        for record in self.records():
+            if idVendor is not None and record.idVendor != idVendor:
+                continue
+            if idProduct is not None and record.idProduct != idProduct:
+                continue
+            if portPath is not None and record.portPath != tuple(portPath):
+                continue
+            if serial is not None and record.serial != serial:
+                continue
+            if manufacturer is not None and record.manufacturer != manufacturer:
+                continue
+            if product is not None and record.product != product:
+                continue
+            found.append(record)
+        return found
+
+    def close(self):
+        if self.context is not None:
+            self.context.close()
+            self.context = None
+
+_defaultIndex = None
+_defaultIndexLock = threading.Lock()
+
+def defaultIndex():
+    # Index shared by the whole process
+    global _defaultIndex
+    with _defaultIndexLock:
+        if _defaultIndex is None:
+            _defaultIndex = usbIndex()
+        return _defaultIndex